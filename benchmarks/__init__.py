@@ -0,0 +1,8 @@
+"""Benchmarks and synthetic data for the expense bot.
+
+Run from the repository root:
+
+    python -m benchmarks.dataset data/bench.db --expenses 100000
+    python -m benchmarks.run --sizes 10000,100000 --output bench.json
+    python -m benchmarks.compare old.json new.json
+"""
@@ -0,0 +1,39 @@
+"""Compare two benchmarks.run JSON files and flag regressions.
+
+Exits with status 1 if any benchmark's median time grew by more than
+--threshold (a ratio, 1.2 = 20% slower) or issued more queries.
+"""
+import argparse
+import json
+import sys
+
+def load(path: str) -> dict:
+    with open(path) as source:
+        report = json.load(source)
+    return {(result["size"], result["name"]): result for result in report["results"]}
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("baseline")
+    parser.add_argument("candidate")
+    parser.add_argument("--threshold", type=float, default=1.2)
+    args = parser.parse_args()
+
+    baseline = load(args.baseline)
+    candidate = load(args.candidate)
+    regressions = 0
+    print(f"{'size':>10} {'benchmark':<45} {'base ms':>10} {'new ms':>10} {'ratio':>7} {'queries':>9}")
+    for key in sorted(baseline.keys() & candidate.keys()):
+        old, new = baseline[key], candidate[key]
+        ratio = new["median_ms"] / old["median_ms"] if old["median_ms"] else float("inf")
+        regressed = ratio > args.threshold or new["queries"] > old["queries"]
+        regressions += regressed
+        print(f"{key[0]:>10} {key[1]:<45} {old['median_ms']:>10.2f} {new['median_ms']:>10.2f} {ratio:>7.2f} "
+              f"{old['queries']:>4}->{new['queries']:<4}{'  REGRESSION' if regressed else ''}")
+
+    for key in sorted(baseline.keys() ^ candidate.keys()):
+        print(f"{key[0]:>10} {key[1]:<45} only in {'baseline' if key in baseline else 'candidate'}")
+    sys.exit(1 if regressions else 0)
+
+if __name__ == "__main__":
+    main()
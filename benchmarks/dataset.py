@@ -0,0 +1,123 @@
+"""Synthetic expense dataset generator.
+
+Fills a database file with users, a fixed number of categories per user
+(the defaults first, then numbered extras) and expenses spread evenly over
+several years, then builds the rollup tables.
+The same arguments and seed always produce the same data.
+"""
+import argparse
+import asyncio
+import random
+import sqlite3
+import time
+from datetime import datetime, timedelta
+
+import pytz
+
+from database import DEFAULT_CATEGORIES, DEFAULT_TIMEZONE, Database, day_number
+
+FIRST_TELEGRAM_ID = 1_000_000
+DEFAULT_END = "2026-01-01"
+CHUNK_SIZE = 50_000
+DESCRIPTIONS = [None, None, "Non", "Taksi", "Bozor", "Kafe", "Dori", "Internet", "Kommunal to'lov"]
+
+def telegram_id(user_index: int) -> int:
+    """Telegram id of the n-th generated user"""
+    return FIRST_TELEGRAM_ID + user_index
+
+def _expense_rows(user_ids, categories, count, years, end, rng):
+    timezone = pytz.timezone(DEFAULT_TIMEZONE)
+    end_date = datetime.fromisoformat(end)
+    span = int(timedelta(days=365 * years).total_seconds())
+    for _ in range(count):
+        user_id = rng.choice(user_ids)
+        date = end_date - timedelta(seconds=rng.randrange(1, span + 1))
+        yield (
+            user_id,
+            rng.randint(1, 500) * 1000,
+            rng.choice(categories[user_id]),
+            rng.choice(DESCRIPTIONS),
+            date.strftime('%Y-%m-%d %H:%M:%S'),
+            int(timezone.localize(date).timestamp()),
+            day_number(date)
+        )
+
+async def generate(
+    path: str,
+    users: int = 10,
+    expenses: int = 100_000,
+    categories: int = len(DEFAULT_CATEGORIES),
+    years: int = 3,
+    seed: int = 42,
+    end: str = DEFAULT_END
+) -> dict:
+    """Create (or extend) a database at path and return what was generated"""
+    if categories < 1:
+        raise ValueError("categories must be at least 1")
+    rng = random.Random(seed)
+    started = time.perf_counter()
+
+    db = Database(path)
+    await db.create_tables()
+    user_ids = [await db.get_or_create_user(telegram_id(i)) for i in range(users)]
+    extra_names = [f"Kategoriya {n}" for n in range(len(DEFAULT_CATEGORIES) + 1, categories + 1)]
+    category_ids = {}
+    for user_id in user_ids:
+        if extra_names:
+            await db.add_categories(user_id, extra_names)
+        # Lowest ids first: the defaults in their usual order, then the extras
+        ids = sorted(category.id for category in await db.get_categories(user_id))
+        category_ids[user_id] = ids[:categories]
+    await db.close()
+
+    # Bulk load with plain sqlite3; far faster than add_expense for millions of rows
+    conn = sqlite3.connect(path)
+    conn.execute("PRAGMA journal_mode = WAL")
+    conn.execute("PRAGMA synchronous = OFF")
+    for user_id, ids in category_ids.items():
+        # Fewer categories than the defaults: drop the surplus defaults
+        conn.execute(
+            f"DELETE FROM categories WHERE user_id = ? AND id NOT IN ({', '.join('?' * len(ids))})",
+            (user_id, *ids)
+        )
+    rows = _expense_rows(user_ids, category_ids, expenses, years, end, rng)
+    while True:
+        chunk = [row for _, row in zip(range(CHUNK_SIZE), rows)]
+        if not chunk:
+            break
+        conn.executemany(
+            "INSERT INTO expenses (user_id, amount, category_id, description, date, ts, day) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            chunk
+        )
+        conn.commit()
+    conn.close()
+
+    db = Database(path)
+    await db.rebuild_rollups()
+    await db.close()
+
+    return {
+        "path": path,
+        "users": users,
+        "expenses": expenses,
+        "categories": categories,
+        "years": years,
+        "seed": seed,
+        "end": end,
+        "seconds": round(time.perf_counter() - started, 3)
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("path", help="database file to create")
+    parser.add_argument("--users", type=int, default=10)
+    parser.add_argument("--expenses", type=int, default=100_000)
+    parser.add_argument("--categories", type=int, default=len(DEFAULT_CATEGORIES), help="categories per user")
+    parser.add_argument("--years", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--end", default=DEFAULT_END, help="latest expense date (YYYY-MM-DD)")
+    args = parser.parse_args()
+    print(asyncio.run(generate(args.path, args.users, args.expenses, args.categories, args.years, args.seed, args.end)))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,283 @@
+"""Time Database methods, the report data path and Excel rendering.
+
+For every dataset size a database is generated (or reused from --data-dir)
+and each benchmark records median/min wall time over --repeat runs, peak
+traced memory of one extra run and the number of SQL statements issued.
+Results are written as JSON for benchmarks.compare.
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import platform
+import sqlite3
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+from benchmarks.dataset import DEFAULT_END, generate, telegram_id
+from database import DEFAULT_CATEGORIES, Database
+
+class QueryCounter:
+    """Count statements executed on the pool's connections"""
+
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, statement: str):
+        self.count += 1
+
+    async def attach(self, db: Database):
+        await db.connect()
+        for conn in db.pool.connections:
+            await conn.set_trace_callback(self)
+
+async def measure(name: str, func, repeat: int, counter: QueryCounter) -> dict:
+    """Run an async callable repeat times plus once under tracemalloc"""
+    # Warm-up run fills caches the way a long-running bot would have them
+    await func()
+
+    times = []
+    queries = 0
+    for _ in range(repeat):
+        before = counter.count
+        started = time.perf_counter()
+        await func()
+        times.append((time.perf_counter() - started) * 1000)
+        queries = counter.count - before
+
+    tracemalloc.start()
+    await func()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    return {
+        "name": name,
+        "median_ms": round(statistics.median(times), 3),
+        "min_ms": round(min(times), 3),
+        "peak_kb": peak // 1024,
+        "queries": queries
+    }
+
+async def _remove_bench_rows(db: Database, user_id: int, last_id: int):
+    """Delete rows written by the add_expense benchmarks and recompute their rollups"""
+    async with db.pool.writer() as conn:
+        async with conn.execute(
+            "SELECT DISTINCT day FROM expenses WHERE id > ?", (last_id,)
+        ) as cursor:
+            days = [row[0] for row in await cursor.fetchall()]
+        await conn.execute("DELETE FROM expenses WHERE id > ?", (last_id,))
+        for day in days:
+            await conn.execute("DELETE FROM daily_totals WHERE user_id = ? AND day = ?", (user_id, day))
+            await conn.execute(
+                """
+                INSERT INTO daily_totals (user_id, day, category_id, total_amount, count)
+                SELECT user_id, day, IFNULL(category_id, 0), SUM(amount), COUNT(*)
+                FROM expenses WHERE user_id = ? AND day = ?
+                GROUP BY IFNULL(category_id, 0)
+                """,
+                (user_id, day)
+            )
+        for month in {day // 100 for day in days}:
+            await conn.execute("DELETE FROM monthly_totals WHERE user_id = ? AND month = ?", (user_id, month))
+            await conn.execute(
+                """
+                INSERT INTO monthly_totals (user_id, month, category_id, total_amount, count)
+                SELECT user_id, ?, category_id, SUM(total_amount), SUM(count)
+                FROM daily_totals WHERE user_id = ? AND day >= ? AND day < ?
+                GROUP BY category_id
+                """,
+                (month, user_id, month * 100, month * 100 + 100)
+            )
+        await conn.commit()
+
+async def bench_size(size: int, args) -> list:
+    path = os.path.join(
+        args.data_dir, f"bench_{size}_{args.users}u_{args.categories}c_{args.years}y_{args.seed}.db"
+    )
+    if not os.path.exists(path):
+        print(f"generating {path}", file=sys.stderr)
+        await generate(path, args.users, size, args.categories, args.years, args.seed)
+
+    db = Database(path)
+    counter = QueryCounter()
+    await counter.attach(db)
+    user_id = await db.get_or_create_user(telegram_id(0))
+
+    end = datetime.fromisoformat(DEFAULT_END) - timedelta(days=1)
+    month_start = end.replace(day=1).strftime('%Y-%m-%d')
+    year_start = (end - timedelta(days=364)).strftime('%Y-%m-%d')
+    all_start = (end - timedelta(days=365 * args.years)).strftime('%Y-%m-%d')
+    end = end.strftime('%Y-%m-%d')
+
+    async def uncached_user():
+        db._user_ids.clear()
+        await db.get_or_create_user(telegram_id(0))
+
+    async def uncached_categories():
+        db.invalidate_categories(user_id)
+        await db.get_categories(user_id)
+
+    # Cursor from the middle of the year, as reached after paging through part of it
+    mid_year = (datetime.fromisoformat(end) - timedelta(days=182)).strftime('%Y-%m-%d')
+    mid_page, _ = await db.get_expenses_page(user_id, mid_year, end, limit=1)
+    mid_cursor = (mid_page[0].date, mid_page[0].id) if mid_page else None
+
+    async def iterate_expenses(start):
+        async for _ in db.iter_expenses(user_id, start, end):
+            pass
+
+    async def uncached_budget():
+        db._budgets.pop(user_id)
+        await db.get_budget(user_id, 1)
+
+    async def report_excel(engine):
+        from reports import generate_excel_report
+        data = await db.get_report_data(user_id, year_start, end)
+        generate_excel_report(
+            data["expenses"], data["category_summary"], data["daily_summary"], year_start, end, engine=engine
+        )
+
+    benchmarks = [
+        ("get_or_create_user (cached)", lambda: db.get_or_create_user(telegram_id(0))),
+        ("get_or_create_user (uncached)", uncached_user),
+        ("get_categories (cached)", lambda: db.get_categories(user_id)),
+        ("get_categories (uncached)", uncached_categories),
+        ("get_category_by_id", lambda: db.get_category_by_id(1, user_id)),
+        ("get_expenses (10)", lambda: db.get_expenses(user_id, 10)),
+        ("get_monthly_summary (month)", lambda: db.get_monthly_summary(user_id, month_start, end)),
+        ("get_daily_summary", lambda: db.get_daily_summary(user_id)),
+        ("get_expenses_by_date_range (month)", lambda: db.get_expenses_by_date_range(user_id, month_start, end)),
+        ("get_expenses_by_date_range (year)", lambda: db.get_expenses_by_date_range(user_id, year_start, end)),
+        ("get_category_summary_by_date_range (year)", lambda: db.get_category_summary_by_date_range(user_id, year_start, end)),
+        ("get_daily_summary_by_date_range (year)", lambda: db.get_daily_summary_by_date_range(user_id, year_start, end)),
+        ("get_report_data (year)", lambda: db.get_report_data(user_id, year_start, end)),
+        ("get_report_data (all)", lambda: db.get_report_data(user_id, all_start, end)),
+        ("get_expenses_page (year, first)", lambda: db.get_expenses_page(user_id, year_start, end)),
+        ("get_expenses_page (year, cursor)", lambda: db.get_expenses_page(user_id, year_start, end, mid_cursor)),
+        ("get_expenses_page (year, backward)", lambda: db.get_expenses_page(user_id, year_start, end, mid_cursor, True)),
+        ("iter_expenses (year)", lambda: iterate_expenses(year_start)),
+        ("iter_expenses (all)", lambda: iterate_expenses(all_start)),
+        ("get_budget (no budget)", lambda: db.get_budget(user_id, 2)),
+        ("get_budget (cached limits)", lambda: db.get_budget(user_id, 1)),
+        ("get_budget (uncached limits)", uncached_budget),
+        ("get_budgets", lambda: db.get_budgets(user_id)),
+        ("generate_excel_report streaming (year)", lambda: report_excel("streaming")),
+    ]
+    if not args.skip_pandas:
+        benchmarks.append(("generate_excel_report pandas (year)", lambda: report_excel("pandas")))
+
+    results = []
+
+    async def record(name, func):
+        result = await measure(name, func, args.repeat, counter)
+        result["size"] = size
+        results.append(result)
+        print(f"{size:>10} {name:<45} {result['median_ms']:>10.2f} ms {result['peak_kb']:>8} KiB {result['queries']:>4} q",
+              file=sys.stderr)
+
+    # Category 1 gets a budget for the get_budget cases; removed below so the dataset stays reusable
+    await db.set_budget(user_id, 1, 1000000)
+    try:
+        for name, func in benchmarks:
+            if not args.filter or args.filter in name:
+                await record(name, func)
+    finally:
+        await db.clear_budget(user_id, 1)
+
+    # Import-sized batch in the current month, as an XLSX/CSV import would insert it
+    import_rows = [(user_id, 1000, 1, "bench", f"{end} 12:00:00")] * 1000
+    category_names = (f"Bench {n}" for n in itertools.count())
+
+    # Writes go last and are removed afterwards so the dataset can be reused
+    writes = [
+        ("add_expense (single)", lambda: db.add_expense(user_id, 1000, 1, "bench")),
+        ("add_expense (burst of 100)", lambda: asyncio.gather(
+            *(db.add_expense(user_id, 1000, 1, "bench") for _ in range(100))
+        )),
+        ("add_expenses (batch of 1000)", lambda: db.add_expenses(import_rows)),
+        ("add_categories (10 new)", lambda: db.add_categories(user_id, [next(category_names) for _ in range(10)])),
+        ("initialize_categories (existing user)", lambda: db.initialize_categories(user_id)),
+        ("set_budget", lambda: db.set_budget(user_id, 1, 1000000)),
+        ("clear_budget", lambda: db.clear_budget(user_id, 1)),
+        ("rebuild_rollups", db.rebuild_rollups),
+    ]
+    writes = [(name, func) for name, func in writes if not args.filter or args.filter in name]
+    if writes:
+        async with db.pool.reader() as conn:
+            async with conn.execute("SELECT IFNULL(MAX(id), 0) FROM expenses") as cursor:
+                last_id = (await cursor.fetchone())[0]
+            async with conn.execute("SELECT IFNULL(MAX(id), 0) FROM categories") as cursor:
+                last_category_id = (await cursor.fetchone())[0]
+        try:
+            for name, func in writes:
+                await record(name, func)
+        finally:
+            await _remove_bench_rows(db, user_id, last_id)
+            await db.clear_budget(user_id, 1)
+            async with db.pool.writer() as conn:
+                await conn.execute("DELETE FROM categories WHERE id > ?", (last_category_id,))
+                await conn.commit()
+            db.invalidate_categories(user_id)
+
+    await db.close()
+    return results
+
+def _git_revision() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+async def run(args) -> dict:
+    os.makedirs(args.data_dir, exist_ok=True)
+    results = []
+    for size in args.sizes:
+        results.extend(await bench_size(size, args))
+    return {
+        "meta": {
+            "revision": _git_revision(),
+            "python": platform.python_version(),
+            "sqlite": sqlite3.sqlite_version,
+            "platform": platform.platform(),
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "users": args.users,
+            "categories": args.categories,
+            "years": args.years,
+            "seed": args.seed,
+            "repeat": args.repeat
+        },
+        "results": results
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", default="10000,100000",
+                        type=lambda value: [int(size) for size in value.split(",")],
+                        help="comma-separated expense row counts")
+    parser.add_argument("--users", type=int, default=10)
+    parser.add_argument("--categories", type=int, default=len(DEFAULT_CATEGORIES), help="categories per user")
+    parser.add_argument("--years", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--data-dir", default="data/bench")
+    parser.add_argument("--filter", help="only run benchmarks whose name contains this text")
+    parser.add_argument("--skip-pandas", action="store_true", help="skip the pandas Excel engine")
+    parser.add_argument("--output", help="write JSON results to this file instead of stdout")
+    args = parser.parse_args()
+
+    report = asyncio.run(run(args))
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump(report, output, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+import asyncio
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional
+
+
+class LRUCache:
+    """Small bounded least-recently-used mapping"""
+
+    def __init__(self, maxsize: int = 1024):
+        self.maxsize = maxsize
+        self._data: OrderedDict = OrderedDict()
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        try:
+            self._data.move_to_end(key)
+        except KeyError:
+            return default
+        return self._data[key]
+
+    def set(self, key: Hashable, value: Any):
+        self._data[key] = value
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def pop(self, key: Hashable, default: Any = None) -> Optional[Any]:
+        return self._data.pop(key, default)
+
+    def clear(self):
+        self._data.clear()
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._data
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+class ReportCache:
+    """LRU of rendered reports bounded by total bytes, with single-flight builds.
+
+    Values are (bytes, filename) tuples or None (nothing to report).
+    Concurrent requests for the same key share one build; failed builds are
+    not cached.
+    """
+
+    def __init__(self, max_bytes: int = 64 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._data: OrderedDict = OrderedDict()
+        self._pending: Dict[Hashable, asyncio.Future] = {}
+
+    # Rough per-entry bookkeeping cost, so empty (None) results are bounded too
+    ENTRY_OVERHEAD = 256
+
+    @classmethod
+    def _sizeof(cls, value: Any) -> int:
+        return cls.ENTRY_OVERHEAD + (len(value[0]) if value else 0)
+
+    async def get_or_create(self, key: Hashable, build: Callable[[], Awaitable[Any]]) -> Any:
+        if key in self._data:
+            self._data.move_to_end(key)
+            return self._data[key]
+
+        pending = self._pending.get(key)
+        if pending is None:
+            pending = asyncio.ensure_future(build())
+            self._pending[key] = pending
+            pending.add_done_callback(lambda future: self._settle(key, future))
+        # Shielded so one waiter giving up does not cancel the shared build
+        return await asyncio.shield(pending)
+
+    def _settle(self, key: Hashable, future: asyncio.Future):
+        self._pending.pop(key, None)
+        if future.cancelled() or future.exception() is not None:
+            return
+        value = future.result()
+        size = self._sizeof(value)
+        if size > self.max_bytes:
+            return
+        self._data[key] = value
+        self.size += size
+        while self.size > self.max_bytes:
+            _, evicted = self._data.popitem(last=False)
+            self.size -= self._sizeof(evicted)
+
+    def clear(self):
+        self._data.clear()
+        self.size = 0
+
+    def __len__(self) -> int:
+        return len(self._data)
@@ -1,92 +1,558 @@
+import asyncio
 import aiosqlite
+import calendar
+import functools
+import hashlib
+import os
+import sqlite3
+import time
+from collections import defaultdict
+from contextlib import asynccontextmanager
 from datetime import datetime, timedelta
 import pytz
-from typing import List, Dict, Optional, Tuple, Any
+from typing import List, Dict, Optional, Tuple, Any, AsyncIterator, Callable, Iterable
+
+from cache import LRUCache
+from migrations import Migration, MigrationRunner
+from records import Budget, Category, CategoryTotal, DailyTotal, Expense
+
+DEFAULT_CATEGORIES = [
+    "🏠 Uy-joy", "🍽️ Oziq-ovqat", "🚗 Transport",
+    "👕 Kiyim-kechak", "💊 Sog'liq", "📚 Ta'lim",
+    "🎮 Ko'ngil ochar", "🛍️ Boshqa"
+]
+DEFAULT_TIMEZONE = "Asia/Tashkent"
+
+def day_number(value: datetime) -> int:
+    """Calendar day as a YYYYMMDD integer, the form kept in expenses.day and the rollups"""
+    return value.year * 10000 + value.month * 100 + value.day
+
+def day_text(day: int) -> str:
+    """YYYYMMDD integer back to 'YYYY-MM-DD'"""
+    return f"{day // 10000:04d}-{day // 100 % 100:02d}-{day % 100:02d}"
+
+def timed(func):
+    """Report the call's duration to Database.query_observer, if one is set"""
+    name = func.__name__.lstrip('_')
+
+    @functools.wraps(func)
+    async def wrapper(self, *args, **kwargs):
+        observer = self.query_observer
+        if observer is None:
+            return await func(self, *args, **kwargs)
+        started = time.perf_counter()
+        try:
+            return await func(self, *args, **kwargs)
+        finally:
+            observer(name, time.perf_counter() - started)
+    return wrapper
+
+class ConnectionPool:
+    """Long-lived SQLite connections: one writer and a small pool of readers"""
+
+    def __init__(self, db_name: str, readers: int = 4):
+        self.db_name = db_name
+        self.readers = readers
+        self._writer: Optional[aiosqlite.Connection] = None
+        self._write_lock = asyncio.Lock()
+        self._read_pool: Optional[asyncio.Queue] = None
+        self._read_connections: List[aiosqlite.Connection] = []
+        self._open_lock = asyncio.Lock()
+
+    @property
+    def is_open(self) -> bool:
+        return self._writer is not None
+
+    @property
+    def connections(self) -> List[aiosqlite.Connection]:
+        """All open connections, writer first"""
+        if not self.is_open:
+            return []
+        return [self._writer] + self._read_connections
+
+    async def _connect(self, read_only: bool = False) -> aiosqlite.Connection:
+        db = await aiosqlite.connect(self.db_name)
+        await db.execute("PRAGMA journal_mode = WAL")
+        await db.execute("PRAGMA synchronous = NORMAL")
+        await db.execute("PRAGMA busy_timeout = 5000")
+        if read_only:
+            await db.execute("PRAGMA query_only = ON")
+        return db
+
+    async def open(self):
+        """Open the writer and reader connections (no-op if already open)"""
+        async with self._open_lock:
+            if self.is_open:
+                return
+            # The writer goes first so WAL mode is set before readers attach
+            self._writer = await self._connect()
+            self._read_pool = asyncio.Queue()
+            for _ in range(self.readers):
+                conn = await self._connect(read_only=True)
+                self._read_connections.append(conn)
+                self._read_pool.put_nowait(conn)
+
+    async def close(self):
+        """Wait for in-flight work and close every connection"""
+        async with self._open_lock:
+            if not self.is_open:
+                return
+            async with self._write_lock:
+                for _ in range(len(self._read_connections)):
+                    await self._read_pool.get()
+                for conn in self._read_connections:
+                    await conn.close()
+                await self._writer.close()
+                self._writer = None
+                self._read_pool = None
+                self._read_connections = []
+
+    @asynccontextmanager
+    async def reader(self) -> AsyncIterator[aiosqlite.Connection]:
+        """Borrow a read-only connection from the pool"""
+        if not self.is_open:
+            await self.open()
+        pool = self._read_pool
+        conn = await pool.get()
+        try:
+            yield conn
+        finally:
+            pool.put_nowait(conn)
+
+    @asynccontextmanager
+    async def writer(self) -> AsyncIterator[aiosqlite.Connection]:
+        """Get exclusive access to the writer connection.
+
+        Uncommitted changes are rolled back if the block raises.
+        """
+        if not self.is_open:
+            await self.open()
+        async with self._write_lock:
+            try:
+                yield self._writer
+            except BaseException:
+                await self._writer.rollback()
+                raise
+
+class GroupCommitQueue:
+    """Collect writes from concurrent handlers and flush them in one transaction.
+
+    A batch is flushed once it holds max_batch items or max_delay seconds
+    after its first item arrived. flush receives the batch and returns one
+    result per item: None on success or the exception for that item.
+    """
+
+    def __init__(self, flush, max_batch: int = 100, max_delay: float = 0.005):
+        self.flush = flush
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+
+    async def submit(self, item: Any):
+        """Queue an item and wait until its batch is committed"""
+        if self._task is None or self._task.done():
+            self._queue = asyncio.Queue()
+            self._task = asyncio.create_task(self._run(self._queue))
+        future = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait((item, future))
+        await future
+
+    async def close(self):
+        """Flush everything queued so far and stop the worker"""
+        if self._task is None:
+            return
+        self._queue.put_nowait(None)
+        await self._task
+        self._task = None
+
+    async def _run(self, queue: asyncio.Queue):
+        loop = asyncio.get_running_loop()
+        stopping = False
+        while not stopping:
+            entry = await queue.get()
+            if entry is None:
+                break
+            batch = [entry]
+            deadline = loop.time() + self.max_delay
+            while len(batch) < self.max_batch:
+                try:
+                    entry = queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    timeout = deadline - loop.time()
+                    if timeout <= 0:
+                        break
+                    try:
+                        entry = await asyncio.wait_for(queue.get(), timeout)
+                    except asyncio.TimeoutError:
+                        break
+                if entry is None:
+                    stopping = True
+                    break
+                batch.append(entry)
+            await self._flush_batch(batch)
+
+    async def _flush_batch(self, batch: List[Tuple[Any, asyncio.Future]]):
+        try:
+            results = await self.flush([item for item, _ in batch])
+        except Exception as e:
+            results = [e] * len(batch)
+        for (_, future), error in zip(batch, results):
+            if future.done():
+                continue
+            if error is None:
+                future.set_result(None)
+            else:
+                future.set_exception(error)
 
 class Database:
-    def __init__(self, db_name: str = "data/personal_expenses.db"):
+    def __init__(
+        self,
+        db_name: str = "data/personal_expenses.db",
+        readers: int = 4,
+        user_cache_size: int = 10000,
+        write_batch_size: int = 100,
+        write_delay: float = 0.005,
+        timezone: str = DEFAULT_TIMEZONE,
+        migration_batch_size: int = 2000
+    ):
         self.db_name = db_name
-        self.timezone = pytz.timezone('Asia/Tashkent')
-
-    async def create_tables(self):
-        async with aiosqlite.connect(self.db_name) as db:
-            # Create users table
-            await db.execute('''
-                CREATE TABLE IF NOT EXISTS users (
-                    id INTEGER PRIMARY KEY,
-                    telegram_id INTEGER UNIQUE NOT NULL,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            ''')
-
-            # Create categories table with user_id
-            await db.execute('''
-                CREATE TABLE IF NOT EXISTS categories (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    user_id INTEGER NOT NULL,
-                    name TEXT NOT NULL,
-                    UNIQUE(user_id, name),
-                    FOREIGN KEY (user_id) REFERENCES users (id)
-                )
-            ''')
-
-            # Create expenses table with user_id
-            await db.execute('''
-                CREATE TABLE IF NOT EXISTS expenses (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    user_id INTEGER NOT NULL,
-                    amount INTEGER NOT NULL,
-                    category_id INTEGER,
-                    description TEXT,
-                    date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    FOREIGN KEY (user_id) REFERENCES users (id),
-                    FOREIGN KEY (category_id) REFERENCES categories (id)
-                )
-            ''')
+        # Local time of the users: day boundaries and the stored date text follow it
+        self.timezone = pytz.timezone(timezone)
+        self.pool = ConnectionPool(db_name, readers)
+        # Called as query_observer(method name, seconds) after each query method
+        self.query_observer: Optional[Callable[[str, float], None]] = None
+        self.migrations = MigrationRunner(self.pool, self._migrations(), migration_batch_size)
+        self._expense_writes = GroupCommitQueue(self._insert_expenses, write_batch_size, write_delay)
+        # telegram_id -> user_id; rows are never updated, only dropped by reset_tables
+        self._user_ids = LRUCache(user_cache_size)
+        # user_id -> categories list; invalidated whenever categories are written
+        self._categories = LRUCache(user_cache_size)
+        # user_id -> {category_id: monthly limit}; invalidated whenever budgets are written
+        self._budgets = LRUCache(user_cache_size)
+        # local hour -> UTC offset in seconds, see _epoch
+        self._utc_offsets = LRUCache(10000)
+        # user_id -> counter value at the user's last data write (see data_version)
+        self._data_versions = LRUCache(user_cache_size)
+        self._version_counter = 0
+        # Version of users without an entry; raised on reset and on eviction
+        self._base_version = 0
+
+    @property
+    def pools(self) -> List[ConnectionPool]:
+        return [self.pool]
+
+    def pool_for(self, telegram_id: int) -> ConnectionPool:
+        """Connection pool holding the Telegram user's data"""
+        return self.pool
+
+    async def connect(self):
+        """Open the connection pool"""
+        await self.pool.open()
+
+    async def close(self):
+        """Flush queued writes and close the connection pool"""
+        await self._expense_writes.close()
+        await self.pool.close()
+
+    @timed
+    async def create_tables(self, backfill: bool = True):
+        """Bring the schema up to date.
+
+        With backfill=False the batched backfills are left for
+        run_backfills, so the bot can start serving right away.
+        """
+        async with self.pool.writer() as db:
+            await self.migrations.apply(db)
+        if backfill:
+            await self.run_backfills()
+
+    async def run_backfills(self):
+        """Finish pending migration backfills in small batches (resumes after a crash)"""
+        await self.migrations.backfill()
+
+    def _migrations(self) -> List[Migration]:
+        # Never edit an applied migration; add a new version instead
+        return [
+            Migration(1, "base tables", self._create_base_tables),
+            Migration(
+                2, "expense timestamps", self._add_expense_timestamps,
+                backfill=self._fill_timestamps, finish=self._index_expense_timestamps
+            ),
+            Migration(3, "rollup tables", self._create_rollup_tables, backfill=self._add_to_rollups),
+            Migration(4, "category budgets", self._create_budgets_table),
+        ]
+
+    async def _create_base_tables(self, db: aiosqlite.Connection) -> bool:
+        # Create users table
+        await db.execute('''
+            CREATE TABLE IF NOT EXISTS users (
+                id INTEGER PRIMARY KEY,
+                telegram_id INTEGER UNIQUE NOT NULL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+
+        # Create categories table with user_id
+        await db.execute('''
+            CREATE TABLE IF NOT EXISTS categories (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id INTEGER NOT NULL,
+                name TEXT NOT NULL,
+                UNIQUE(user_id, name),
+                FOREIGN KEY (user_id) REFERENCES users (id)
+            )
+        ''')
+
+        # Create expenses table with user_id
+        await db.execute('''
+            CREATE TABLE IF NOT EXISTS expenses (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id INTEGER NOT NULL,
+                amount INTEGER NOT NULL,
+                category_id INTEGER,
+                description TEXT,
+                date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                FOREIGN KEY (user_id) REFERENCES users (id),
+                FOREIGN KEY (category_id) REFERENCES categories (id)
+            )
+        ''')
+
+        # FSM dialog state, see storage.SQLiteStorage
+        await db.execute('''
+            CREATE TABLE IF NOT EXISTS fsm_states (
+                key TEXT PRIMARY KEY,
+                state TEXT,
+                data TEXT NOT NULL,
+                updated_at REAL NOT NULL
+            )
+        ''')
+        await db.execute('''
+            CREATE INDEX IF NOT EXISTS idx_fsm_states_updated_at
+            ON fsm_states (updated_at)
+        ''')
+        return False
+
+    async def _add_expense_timestamps(self, db: aiosqlite.Connection) -> bool:
+        # date is the local 'YYYY-MM-DD HH:MM:SS' text shown to users; ts (epoch
+        # seconds) and day (local YYYYMMDD) are what queries filter and group on
+        cursor = await db.execute("SELECT name FROM pragma_table_info('expenses')")
+        columns = {row[0] for row in await cursor.fetchall()}
+        await cursor.close()
+        if 'ts' in columns:
+            return False
+        await db.execute('ALTER TABLE expenses ADD COLUMN ts INTEGER')
+        await db.execute('ALTER TABLE expenses ADD COLUMN day INTEGER')
+        return True
+
+    async def _index_expense_timestamps(self, db: aiosqlite.Connection):
+        # Covering index for per-user time range reports; built once ts is filled.
+        # The build is one statement over the whole expenses table, so it holds
+        # the writer for a time proportional to the table (seconds for millions
+        # of rows); expense writes queue in the group commit until it is done.
+        # It runs from the background backfill, after the bot has started.
+        await db.execute('''
+            CREATE INDEX IF NOT EXISTS idx_expenses_user_ts
+            ON expenses (user_id, ts, amount, category_id)
+        ''')
+        await db.execute('DROP INDEX IF EXISTS idx_expenses_user_date')
+
+    async def _fill_timestamps(self, db: aiosqlite.Connection, start: int = 0, stop: Optional[int] = None):
+        """Set ts and day on expenses with id in (start, stop] that only have the date text (no commit)"""
+        await db.create_function('local_epoch', 1, lambda date: self._timestamps(date)[0], deterministic=True)
+        await db.execute(
+            f'''
+            UPDATE expenses SET
+                ts = local_epoch(date),
+                day = CAST(substr(date, 1, 4) || substr(date, 6, 2) || substr(date, 9, 2) AS INTEGER)
+            WHERE id > ? {"" if stop is None else "AND id <= ?"} AND ts IS NULL
+            ''',
+            (start,) if stop is None else (start, stop)
+        )
+
+    async def _create_rollup_tables(self, db: aiosqlite.Connection) -> bool:
+        # Rollup tables maintained by _insert_expenses; category_id 0 means no category
+        cursor = await db.execute("SELECT type FROM pragma_table_info('daily_totals') WHERE name = 'day'")
+        day_type = await cursor.fetchone()
+        await cursor.close()
+        if day_type is not None and day_type[0] == 'INTEGER':
+            # Already built with integer day keys before migrations were versioned
+            return False
+        if day_type is not None:
+            # Rollups keyed by 'YYYY-MM-DD' text; rebuilt from expenses
+            await db.execute('DROP TABLE daily_totals')
+            await db.execute('DROP TABLE IF EXISTS monthly_totals')
+
+        await db.execute('''
+            CREATE TABLE IF NOT EXISTS daily_totals (
+                user_id INTEGER NOT NULL,
+                day INTEGER NOT NULL,
+                category_id INTEGER NOT NULL,
+                total_amount INTEGER NOT NULL,
+                count INTEGER NOT NULL,
+                PRIMARY KEY (user_id, day, category_id)
+            ) WITHOUT ROWID
+        ''')
+        await db.execute('''
+            CREATE TABLE IF NOT EXISTS monthly_totals (
+                user_id INTEGER NOT NULL,
+                month INTEGER NOT NULL,
+                category_id INTEGER NOT NULL,
+                total_amount INTEGER NOT NULL,
+                count INTEGER NOT NULL,
+                PRIMARY KEY (user_id, month, category_id)
+            ) WITHOUT ROWID
+        ''')
+        return True
+
+    async def _add_to_rollups(self, db: aiosqlite.Connection, start: int, stop: int):
+        """Add the expenses with id in (start, stop] to the rollup tables (no commit)"""
+        for table, column, key in (('daily_totals', 'day', 'day'), ('monthly_totals', 'month', 'day / 100')):
+            await db.execute(
+                f"""
+                INSERT INTO {table} (user_id, {column}, category_id, total_amount, count)
+                SELECT user_id, {key}, IFNULL(category_id, 0), SUM(amount), COUNT(*)
+                FROM expenses
+                WHERE id > ? AND id <= ?
+                GROUP BY user_id, {key}, IFNULL(category_id, 0)
+                ON CONFLICT (user_id, {column}, category_id) DO UPDATE SET
+                    total_amount = total_amount + excluded.total_amount,
+                    count = count + excluded.count
+                """,
+                (start, stop)
+            )
+
+    async def _create_budgets_table(self, db: aiosqlite.Connection) -> bool:
+        # Monthly limit per category; spending is read from monthly_totals
+        await db.execute('''
+            CREATE TABLE IF NOT EXISTS budgets (
+                user_id INTEGER NOT NULL,
+                category_id INTEGER NOT NULL,
+                amount INTEGER NOT NULL,
+                PRIMARY KEY (user_id, category_id)
+            ) WITHOUT ROWID
+        ''')
+        return False
+
+    async def _fill_rollups(self, db: aiosqlite.Connection):
+        """Recompute daily_totals and monthly_totals from expenses (no commit)"""
+        await db.execute('DELETE FROM daily_totals')
+        await db.execute('DELETE FROM monthly_totals')
+        await db.execute('''
+            INSERT INTO daily_totals (user_id, day, category_id, total_amount, count)
+            SELECT user_id, day, IFNULL(category_id, 0), SUM(amount), COUNT(*)
+            FROM expenses
+            GROUP BY user_id, day, IFNULL(category_id, 0)
+        ''')
+        await db.execute('''
+            INSERT INTO monthly_totals (user_id, month, category_id, total_amount, count)
+            SELECT user_id, day / 100, category_id, SUM(total_amount), SUM(count)
+            FROM daily_totals
+            GROUP BY user_id, day / 100, category_id
+        ''')
+
+    @timed
+    async def rebuild_rollups(self):
+        """Rebuild the rollup tables after expenses were written outside add_expense.
+
+        Rows inserted with only the date text get their ts and day first.
+        """
+        async with self.pool.writer() as db:
+            await self._fill_timestamps(db)
+            await self._fill_rollups(db)
             await db.commit()
 
+    def _epoch(self, local: datetime) -> int:
+        """Epoch seconds of a naive datetime read as local time"""
+        hour = local.replace(minute=0, second=0, microsecond=0)
+        # pytz localize is slow; offsets are cached per local hour for the backfills
+        offset = self._utc_offsets.get(hour)
+        if offset is None:
+            offset = int(self.timezone.localize(hour).utcoffset().total_seconds())
+            self._utc_offsets.set(hour, offset)
+        return calendar.timegm(local.timetuple()) - offset
+
+    def _timestamps(self, date: str) -> Tuple[int, int]:
+        """(ts, day) column values for a local 'YYYY-MM-DD HH:MM:SS' date"""
+        local = datetime.fromisoformat(date)
+        return self._epoch(local), day_number(local)
+
+    @staticmethod
+    def _rollup_source(start: int, end: int) -> Tuple[str, str, int, int]:
+        """Pick the rollup table for half-open [start, end) YYYYMMDD bounds.
+
+        Whole-month ranges read monthly_totals, anything else daily_totals.
+        Returns (table, key column, low, high).
+        """
+        if start % 100 == 1 and end % 100 == 1:
+            return 'monthly_totals', 'month', start // 100, end // 100
+        return 'daily_totals', 'day', start, end
+
+    @staticmethod
+    def _day_bounds(start_date: str, end_date: str) -> Tuple[int, int]:
+        """Turn an inclusive YYYY-MM-DD range into half-open [start, end) YYYYMMDD bounds"""
+        start = datetime.strptime(start_date[:10], '%Y-%m-%d')
+        end = datetime.strptime(end_date[:10], '%Y-%m-%d') + timedelta(days=1)
+        return day_number(start), day_number(end)
+
+    def _time_bounds(self, start_date: str, end_date: str) -> Tuple[int, int]:
+        """The same range as epoch seconds of its local midnights.
+
+        Compared against expenses.ts, so it can use idx_expenses_user_ts
+        and follows the configured timezone rather than SQLite's UTC.
+        """
+        start = datetime.strptime(start_date[:10], '%Y-%m-%d')
+        end = datetime.strptime(end_date[:10], '%Y-%m-%d') + timedelta(days=1)
+        return self._epoch(start), self._epoch(end)
+
+    @timed
     async def get_or_create_user(self, telegram_id: int) -> int:
         """Get or create user and return user_id"""
-        async with aiosqlite.connect(self.db_name) as db:
-            # Try to get existing user
+        user_id = self._user_ids.get(telegram_id)
+        if user_id is not None:
+            return user_id
+
+        # Try to get existing user
+        async with self.pool.reader() as db:
             cursor = await db.execute(
                 'SELECT id FROM users WHERE telegram_id = ?',
                 (telegram_id,)
             )
             user = await cursor.fetchone()
 
-            if user:
-                return user[0]
-
-            # Create new user
-            await db.execute(
-                'INSERT INTO users (telegram_id) VALUES (?)',
-                (telegram_id,)
-            )
-            await db.commit()
+        if user:
+            self._user_ids.set(telegram_id, user[0])
+            return user[0]
 
-            # Get the new user's id
+        async with self.pool.writer() as db:
+            # Create new user; another handler may have created it meanwhile
             cursor = await db.execute(
-                'SELECT id FROM users WHERE telegram_id = ?',
+                'INSERT INTO users (telegram_id) VALUES (?) '
+                'ON CONFLICT (telegram_id) DO NOTHING RETURNING id',
                 (telegram_id,)
             )
             user = await cursor.fetchone()
+            await cursor.close()
 
-            # Create default categories for the new user
-            default_categories = [
-                "🏠 Uy-joy", "🍽️ Oziq-ovqat", "🚗 Transport",
-                "👕 Kiyim-kechak", "💊 Sog'liq", "📚 Ta'lim",
-                "🎮 Ko'ngil ochar", "🛍️ Boshqa"
-            ]
-            for category in default_categories:
-                await db.execute(
+            if user:
+                # Create default categories for the new user
+                await db.executemany(
                     'INSERT OR IGNORE INTO categories (user_id, name) VALUES (?, ?)',
-                    (user[0], category)
+                    [(user[0], category) for category in DEFAULT_CATEGORIES]
                 )
+            else:
+                cursor = await db.execute(
+                    'SELECT id FROM users WHERE telegram_id = ?',
+                    (telegram_id,)
+                )
+                user = await cursor.fetchone()
             await db.commit()
 
-            return user[0]
+        self.invalidate_categories(user[0])
+        self._user_ids.set(telegram_id, user[0])
+        return user[0]
 
+    @timed
     async def initialize_categories(self, user_id: int):
         """Initialize default categories for new user"""
         default_categories = [
@@ -96,107 +562,299 @@ class Database:
             "💰 Boshqa"
         ]
         
-        async with aiosqlite.connect(self.db_name) as db:
+        async with self.pool.writer() as db:
             await db.executemany(
                 "INSERT OR IGNORE INTO categories (user_id, name) VALUES (?, ?)",
                 [(user_id, category) for category in default_categories]
             )
             await db.commit()
+        self.invalidate_categories(user_id)
 
+    @timed
     async def add_expense(self, user_id: int, amount: int, category_id: int, description: str = None) -> bool:
-        async with aiosqlite.connect(self.db_name) as db:
-            current_time = datetime.now(self.timezone).strftime('%Y-%m-%d %H:%M:%S')
+        """Queue the expense for the next group commit and wait until it is saved"""
+        current_time = datetime.now(self.timezone).strftime('%Y-%m-%d %H:%M:%S')
+        await self._expense_writes.submit((user_id, amount, category_id, description, current_time))
+        return True
+
+    @timed
+    async def add_expenses(self, rows: List[Tuple]) -> int:
+        """Insert (user_id, amount, category_id, description, date) rows in one transaction.
+
+        Meant for bulk imports: the rows bypass the group-commit queue, and
+        the number actually stored is returned.
+        """
+        results = await self._insert_expenses(rows)
+        return results.count(None)
+
+    @timed
+    async def _insert_expenses(self, rows: List[Tuple]) -> List[Optional[Exception]]:
+        """Insert a batch of expense rows in a single transaction"""
+        query = (
+            "INSERT INTO expenses (user_id, amount, category_id, description, date, ts, day) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)"
+        )
+        rows = [(*row, *self._timestamps(row[4])) for row in rows]
+        async with self.pool.writer() as db:
+            try:
+                await db.executemany(query, rows)
+                results = [None] * len(rows)
+            except sqlite3.Error:
+                # Retry row by row so only the offending rows are rejected
+                await db.rollback()
+                results = []
+                for row in rows:
+                    try:
+                        await db.execute(query, row)
+                        results.append(None)
+                    except sqlite3.Error as e:
+                        results.append(e)
+            await self._update_rollups(db, [row for row, error in zip(rows, results) if error is None])
+            await db.commit()
+
+        self._bump_versions({row[0] for row, error in zip(rows, results) if error is None})
+        return results
+
+    def _bump_versions(self, user_ids: Iterable[int]):
+        """Give the users a new data version after a committed write"""
+        self._version_counter += 1
+        versions = self._data_versions
+        for user_id in user_ids:
+            if user_id not in versions and len(versions) >= versions.maxsize:
+                # The evicted user falls back to the base version, which must not go back
+                self._base_version = self._version_counter
+            versions.set(user_id, self._version_counter)
+
+    def data_version(self, user_id: int) -> int:
+        """Version of the user's data; changes after every committed write
+        of their expenses, categories or budgets.
+
+        Versions only ever increase within a process, so they are safe to
+        use in cache keys, and a read that saw the same version before and
+        after may cache its result.
+        """
+        return self._data_versions.get(user_id, self._base_version)
+
+    async def _update_rollups(self, db: aiosqlite.Connection, rows: List[Tuple]):
+        """Add inserted expense rows to daily_totals and monthly_totals"""
+        daily = defaultdict(lambda: [0, 0])
+        monthly = defaultdict(lambda: [0, 0])
+        for user_id, amount, category_id, _, _, _, day in rows:
+            for totals, key in ((daily, day), (monthly, day // 100)):
+                entry = totals[(user_id, key, category_id or 0)]
+                entry[0] += amount
+                entry[1] += 1
+
+        for table, column, totals in (('daily_totals', 'day', daily), ('monthly_totals', 'month', monthly)):
+            await db.executemany(
+                f"""
+                INSERT INTO {table} (user_id, {column}, category_id, total_amount, count)
+                VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT (user_id, {column}, category_id) DO UPDATE SET
+                    total_amount = total_amount + excluded.total_amount,
+                    count = count + excluded.count
+                """,
+                [(*key, total, count) for key, (total, count) in totals.items()]
+            )
+
+    @timed
+    async def add_categories(self, user_id: int, names: Iterable[str]) -> List[Category]:
+        """Create the categories the user does not have yet and return the full list"""
+        async with self.pool.writer() as db:
+            await db.executemany(
+                "INSERT OR IGNORE INTO categories (user_id, name) VALUES (?, ?)",
+                [(user_id, name) for name in names]
+            )
+            await db.commit()
+        self.invalidate_categories(user_id)
+        return await self.get_categories(user_id)
+
+    def invalidate_categories(self, user_id: int):
+        """Drop cached categories after the user's categories change"""
+        self._categories.pop(user_id)
+        # A get_categories that read the old rows must not cache them now
+        self._bump_versions((user_id,))
+
+    @timed
+    async def get_categories(self, user_id: int) -> List[Category]:
+        """Get user categories ordered by name (cached; treat as read-only)"""
+        categories = self._categories.get(user_id)
+        if categories is not None:
+            return categories
+
+        version = self.data_version(user_id)
+        async with self.pool.reader() as db:
+            async with db.execute(
+                "SELECT id, name FROM categories WHERE user_id = ? ORDER BY name",
+                (user_id,)
+            ) as cursor:
+                categories = list(map(Category._make, await cursor.fetchall()))
+
+        if self.data_version(user_id) == version:
+            self._categories.set(user_id, categories)
+        return categories
+
+    async def get_category_by_id(self, category_id: int, user_id: int) -> Optional[Category]:
+        for category in await self.get_categories(user_id):
+            if category.id == category_id:
+                return category
+        return None
+
+    @timed
+    async def set_budget(self, user_id: int, category_id: int, amount: int):
+        """Set the monthly limit of a category, replacing any previous one"""
+        async with self.pool.writer() as db:
             await db.execute(
-                "INSERT INTO expenses (user_id, amount, category_id, description, date) VALUES (?, ?, ?, ?, ?)",
-                (user_id, amount, category_id, description, current_time)
+                "INSERT INTO budgets (user_id, category_id, amount) VALUES (?, ?, ?) "
+                "ON CONFLICT (user_id, category_id) DO UPDATE SET amount = excluded.amount",
+                (user_id, category_id, amount)
             )
             await db.commit()
-            return True
+        self._invalidate_budgets(user_id)
+
+    @timed
+    async def clear_budget(self, user_id: int, category_id: int) -> bool:
+        """Remove a category's budget; returns whether there was one"""
+        async with self.pool.writer() as db:
+            cursor = await db.execute(
+                "DELETE FROM budgets WHERE user_id = ? AND category_id = ?",
+                (user_id, category_id)
+            )
+            await db.commit()
+        self._invalidate_budgets(user_id)
+        return cursor.rowcount > 0
+
+    def _invalidate_budgets(self, user_id: int):
+        """Drop cached budget limits after the user's budgets change"""
+        self._budgets.pop(user_id)
+        # A _budget_limits that read the old rows must not cache them now
+        self._bump_versions((user_id,))
+
+    async def _budget_limits(self, user_id: int) -> Dict[int, int]:
+        """category_id -> monthly limit (cached)"""
+        limits = self._budgets.get(user_id)
+        if limits is not None:
+            return limits
 
-    async def get_categories(self, user_id: int) -> List[Dict[str, Any]]:
-        async with aiosqlite.connect(self.db_name) as db:
-            db.row_factory = aiosqlite.Row
+        version = self.data_version(user_id)
+        async with self.pool.reader() as db:
             async with db.execute(
-                "SELECT * FROM categories WHERE user_id = ? ORDER BY name",
+                "SELECT category_id, amount FROM budgets WHERE user_id = ?",
                 (user_id,)
             ) as cursor:
-                return [dict(row) for row in await cursor.fetchall()]
+                limits = dict(await cursor.fetchall())
+
+        if self.data_version(user_id) == version:
+            self._budgets.set(user_id, limits)
+        return limits
+
+    @timed
+    async def get_budgets(self, user_id: int) -> List[Budget]:
+        """All budgets of the user with this month's spending, ordered by category name"""
+        month = day_number(datetime.now(self.timezone)) // 100
+        async with self.pool.reader() as db:
+            query = """
+                SELECT b.category_id, c.name, b.amount, IFNULL(m.total_amount, 0)
+                FROM budgets b
+                JOIN categories c ON c.id = b.category_id
+                LEFT JOIN monthly_totals m
+                    ON m.user_id = b.user_id AND m.month = ? AND m.category_id = b.category_id
+                WHERE b.user_id = ?
+                ORDER BY c.name
+            """
+            async with db.execute(query, (month, user_id)) as cursor:
+                return list(map(Budget._make, await cursor.fetchall()))
+
+    @timed
+    async def get_budget(self, user_id: int, category_id: int) -> Optional[Budget]:
+        """The category's budget with this month's spending, or None.
+
+        Spending is the category's monthly_totals row, which add_expense
+        updates in the same transaction as the insert, so this is a single
+        primary-key lookup; categories without a budget need no query.
+        """
+        amount = (await self._budget_limits(user_id)).get(category_id)
+        if amount is None:
+            return None
 
-    async def get_category_by_id(self, category_id: int, user_id: int) -> Optional[Dict[str, Any]]:
-        async with aiosqlite.connect(self.db_name) as db:
-            db.row_factory = aiosqlite.Row
+        month = day_number(datetime.now(self.timezone)) // 100
+        async with self.pool.reader() as db:
             async with db.execute(
-                "SELECT * FROM categories WHERE id = ? AND user_id = ?",
-                (category_id, user_id)
+                "SELECT total_amount FROM monthly_totals WHERE user_id = ? AND month = ? AND category_id = ?",
+                (user_id, month, category_id)
             ) as cursor:
                 row = await cursor.fetchone()
-                return dict(row) if row else None
 
-    async def get_expenses(self, user_id: int, limit: int = 10) -> List[Dict[str, Any]]:
-        async with aiosqlite.connect(self.db_name) as db:
-            db.row_factory = aiosqlite.Row
+        category = await self.get_category_by_id(category_id, user_id)
+        return Budget(category_id, category.name if category else None, amount, row[0] if row else 0)
+
+    @timed
+    async def get_expenses(self, user_id: int, limit: int = 10) -> List[Expense]:
+        async with self.pool.reader() as db:
             query = """
-                SELECT e.*, c.name as category_name 
+                SELECT e.id, e.date, e.amount, c.name as category_name, e.description
                 FROM expenses e 
                 LEFT JOIN categories c ON e.category_id = c.id 
                 WHERE e.user_id = ?
-                ORDER BY e.date DESC 
+                ORDER BY e.ts DESC, e.id DESC
                 LIMIT ?
             """
             async with db.execute(query, (user_id, limit)) as cursor:
-                return [dict(row) for row in await cursor.fetchall()]
+                return list(map(Expense._make, await cursor.fetchall()))
 
-    async def get_monthly_summary(self, user_id: int, start_date: str = None, end_date: str = None) -> List[Dict[str, Any]]:
+    @timed
+    async def get_monthly_summary(self, user_id: int, start_date: str = None, end_date: str = None) -> List[CategoryTotal]:
         """Get monthly expenses summary for user"""
-        async with aiosqlite.connect(self.db_name) as db:
-            db.row_factory = aiosqlite.Row
-            query = """
+        if start_date and end_date:
+            start, end = self._day_bounds(start_date, end_date)
+        else:
+            # Default to current month if no dates provided
+            now = datetime.now(self.timezone)
+            start = day_number(now.replace(day=1))
+            end = day_number((now.replace(day=1) + timedelta(days=32)).replace(day=1))
+        table, column, low, high = self._rollup_source(start, end)
+
+        async with self.pool.reader() as db:
+            query = f"""
                 SELECT 
                     c.name as category_name,
-                    SUM(e.amount) as total_amount
-                FROM expenses e 
-                LEFT JOIN categories c ON e.category_id = c.id 
-                WHERE e.user_id = ?
-                AND date(e.date) >= date(?)
-                AND date(e.date) <= date(?)
+                    SUM(t.count) as count,
+                    SUM(t.total_amount) as total_amount
+                FROM {table} t 
+                LEFT JOIN categories c ON t.category_id = c.id 
+                WHERE t.user_id = ?
+                AND t.{column} >= ?
+                AND t.{column} < ?
                 GROUP BY c.name
                 ORDER BY total_amount DESC
             """
-            params = [user_id]
-            
-            if start_date and end_date:
-                params.extend([start_date, end_date])
-            else:
-                # Default to current month if no dates provided
-                now = datetime.now(self.timezone)
-                start_of_month = now.replace(day=1).strftime('%Y-%m-%d')
-                end_of_month = (now.replace(day=1) + timedelta(days=32)).replace(day=1) - timedelta(days=1)
-                params.extend([start_of_month, end_of_month.strftime('%Y-%m-%d')])
-            
-            async with db.execute(query, params) as cursor:
-                return [dict(row) for row in await cursor.fetchall()]
+            async with db.execute(query, (user_id, low, high)) as cursor:
+                return list(map(CategoryTotal._make, await cursor.fetchall()))
 
-    async def get_daily_summary(self, user_id: int) -> List[Dict[str, Any]]:
-        async with aiosqlite.connect(self.db_name) as db:
-            db.row_factory = aiosqlite.Row
+    @timed
+    async def get_daily_summary(self, user_id: int) -> List[DailyTotal]:
+        since = day_number(datetime.now(self.timezone) - timedelta(days=7))
+        async with self.pool.reader() as db:
             query = """
                 SELECT 
-                    date(e.date) as expense_date,
-                    SUM(e.amount) as total_amount
-                FROM expenses e 
-                WHERE e.user_id = ? AND e.date >= date('now', '-7 days')
-                GROUP BY date(e.date)
+                    day as expense_date,
+                    SUM(total_amount) as total_amount,
+                    SUM(count) as count
+                FROM daily_totals 
+                WHERE user_id = ? AND day >= ?
+                GROUP BY day
                 ORDER BY expense_date DESC
             """
-            async with db.execute(query, (user_id,)) as cursor:
-                return [dict(row) for row in await cursor.fetchall()]
+            async with db.execute(query, (user_id, since)) as cursor:
+                return [DailyTotal(day_text(day), total, count) for day, total, count in await cursor.fetchall()]
 
-    async def get_expenses_by_date_range(self, user_id: int, start_date: str, end_date: str) -> List[Dict[str, Any]]:
+    @timed
+    async def get_expenses_by_date_range(self, user_id: int, start_date: str, end_date: str) -> List[Expense]:
         """Get expenses within date range"""
-        async with aiosqlite.connect(self.db_name) as db:
-            db.row_factory = aiosqlite.Row
+        async with self.pool.reader() as db:
             query = """
                 SELECT 
+                    e.id,
                     e.date,
                     e.amount,
                     c.name as category_name,
@@ -204,58 +862,405 @@ class Database:
                 FROM expenses e 
                 LEFT JOIN categories c ON e.category_id = c.id 
                 WHERE e.user_id = ?
-                AND date(e.date) >= date(?) 
-                AND date(e.date) <= date(?)
-                ORDER BY e.date ASC, e.id ASC
+                AND e.ts >= ?
+                AND e.ts < ?
+                ORDER BY e.ts ASC, e.id ASC
             """
-            async with db.execute(query, (user_id, start_date, end_date)) as cursor:
-                return [dict(row) for row in await cursor.fetchall()]
+            async with db.execute(query, (user_id, *self._time_bounds(start_date, end_date))) as cursor:
+                return list(map(Expense._make, await cursor.fetchall()))
+
+    async def iter_expenses(
+        self,
+        user_id: int,
+        start_date: Optional[str] = None,
+        end_date: Optional[str] = None,
+        batch_size: int = 1000
+    ) -> AsyncIterator[List[Tuple]]:
+        """Stream (date, amount, category_name, description) rows in date order, batch_size at a time.
 
-    async def get_category_summary_by_date_range(self, user_id: int, start_date: str, end_date: str) -> List[Dict[str, Any]]:
-        async with aiosqlite.connect(self.db_name) as db:
-            db.row_factory = aiosqlite.Row
+        One reader connection stays checked out until the iteration ends,
+        and at most one batch is held in memory.
+        """
+        conditions = ["e.user_id = ?"]
+        params: List[Any] = [user_id]
+        if start_date:
+            conditions.append("e.ts >= ?")
+            params.append(self._time_bounds(start_date, start_date)[0])
+        if end_date:
+            conditions.append("e.ts < ?")
+            params.append(self._time_bounds(end_date, end_date)[1])
+
+        async with self.pool.reader() as db:
+            query = f"""
+                SELECT e.date, e.amount, c.name, e.description
+                FROM expenses e 
+                LEFT JOIN categories c ON e.category_id = c.id 
+                WHERE {" AND ".join(conditions)}
+                ORDER BY e.ts ASC, e.id ASC
+            """
+            async with db.execute(query, params) as cursor:
+                while True:
+                    rows = await cursor.fetchmany(batch_size)
+                    if not rows:
+                        break
+                    yield rows
+
+    @timed
+    async def get_expenses_page(
+        self,
+        user_id: int,
+        start_date: Optional[str] = None,
+        end_date: Optional[str] = None,
+        cursor: Optional[Tuple[str, int]] = None,
+        backward: bool = False,
+        limit: int = 10,
+        category_id: Optional[int] = None
+    ) -> Tuple[List[Expense], bool]:
+        """Get one page of expenses, ordered by (date, id).
+
+        cursor is the (date, id) of the row the page starts after, or ends
+        before when backward is set. Either date bound and the category may
+        be left out. Returns the rows in ascending order and whether more
+        rows exist beyond the page in the direction of travel.
+        """
+        conditions = ["e.user_id = ?"]
+        params: List[Any] = [user_id]
+        if start_date:
+            conditions.append("e.ts >= ?")
+            params.append(self._time_bounds(start_date, start_date)[0])
+        if end_date:
+            conditions.append("e.ts < ?")
+            params.append(self._time_bounds(end_date, end_date)[1])
+        if category_id is not None:
+            conditions.append("e.category_id = ?")
+            params.append(category_id)
+        if cursor is not None:
+            conditions.append("(e.ts, e.id) < (?, ?)" if backward else "(e.ts, e.id) > (?, ?)")
+            params.extend((self._timestamps(cursor[0])[0], cursor[1]))
+        order = "DESC" if backward else "ASC"
+
+        async with self.pool.reader() as db:
+            query = f"""
+                SELECT 
+                    e.id,
+                    e.date,
+                    e.amount,
+                    c.name as category_name,
+                    e.description
+                FROM expenses e 
+                LEFT JOIN categories c ON e.category_id = c.id 
+                WHERE {" AND ".join(conditions)}
+                ORDER BY e.ts {order}, e.id {order}
+                LIMIT ?
+            """
+            async with db.execute(query, (*params, limit + 1)) as cursor_:
+                rows = list(map(Expense._make, await cursor_.fetchall()))
+
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        if backward:
+            rows.reverse()
+        return rows, has_more
+
+    @timed
+    async def get_report_data(self, user_id: int, start_date: str, end_date: str) -> Dict[str, list]:
+        """Get expenses, category summary and daily summary for a date range.
+
+        The range is read once and both summaries are derived from the same
+        rows, so the three lists always agree with each other.
+        """
+        async with self.pool.reader() as db:
             query = """
                 SELECT 
+                    e.id,
+                    e.date,
+                    e.amount,
                     c.name as category_name,
-                    COUNT(*) as count,
-                    SUM(e.amount) as total_amount
+                    e.description,
+                    e.category_id,
+                    e.day
                 FROM expenses e 
                 LEFT JOIN categories c ON e.category_id = c.id 
                 WHERE e.user_id = ?
-                AND date(e.date) >= date(?)
-                AND date(e.date) <= date(?)
-                GROUP BY c.id, c.name
+                AND e.ts >= ?
+                AND e.ts < ?
+                ORDER BY e.ts ASC, e.id ASC
+            """
+            async with db.execute(query, (user_id, *self._time_bounds(start_date, end_date))) as cursor:
+                rows = await cursor.fetchall()
+
+        expenses = []
+        # category_id -> [name, count, total]; day -> [total, count]
+        categories: Dict[Any, list] = {}
+        days: Dict[int, list] = {}
+        for expense_id, date, amount, category_name, description, category_id, day_key in rows:
+            expenses.append(Expense(expense_id, date, amount, category_name, description))
+
+            category = categories.get(category_id)
+            if category is None:
+                category = categories[category_id] = [category_name, 0, 0]
+            category[1] += 1
+            category[2] += amount
+
+            # Rows are date-ordered, so days are created in ascending order
+            day = days.get(day_key)
+            if day is None:
+                day = days[day_key] = [0, 0]
+            day[0] += amount
+            day[1] += 1
+
+        return {
+            "expenses": expenses,
+            "category_summary": sorted(
+                map(CategoryTotal._make, categories.values()), key=lambda c: c.total_amount, reverse=True
+            ),
+            "daily_summary": [DailyTotal(day_text(day), total, count) for day, (total, count) in days.items()]
+        }
+
+    @timed
+    async def get_category_summary_by_date_range(self, user_id: int, start_date: str, end_date: str) -> List[CategoryTotal]:
+        table, column, low, high = self._rollup_source(*self._day_bounds(start_date, end_date))
+        async with self.pool.reader() as db:
+            query = f"""
+                SELECT 
+                    c.name as category_name,
+                    SUM(t.count) as count,
+                    SUM(t.total_amount) as total_amount
+                FROM {table} t 
+                LEFT JOIN categories c ON t.category_id = c.id 
+                WHERE t.user_id = ?
+                AND t.{column} >= ?
+                AND t.{column} < ?
+                GROUP BY t.category_id, c.name
                 ORDER BY total_amount DESC
             """
-            async with db.execute(query, (user_id, start_date, end_date)) as cursor:
-                return [dict(row) for row in await cursor.fetchall()]
+            async with db.execute(query, (user_id, low, high)) as cursor:
+                return list(map(CategoryTotal._make, await cursor.fetchall()))
 
-    async def get_daily_summary_by_date_range(self, user_id: int, start_date: str, end_date: str) -> List[Dict[str, Any]]:
-        async with aiosqlite.connect(self.db_name) as db:
-            db.row_factory = aiosqlite.Row
+    @timed
+    async def get_daily_summary_by_date_range(self, user_id: int, start_date: str, end_date: str) -> List[DailyTotal]:
+        async with self.pool.reader() as db:
             query = """
                 SELECT 
-                    date(e.date) as expense_date,
-                    SUM(e.amount) as total_amount,
-                    COUNT(*) as count
-                FROM expenses e 
-                WHERE e.user_id = ?
-                AND date(e.date) >= date(?)
-                AND date(e.date) <= date(?)
-                GROUP BY date(e.date)
+                    day as expense_date,
+                    SUM(total_amount) as total_amount,
+                    SUM(count) as count
+                FROM daily_totals 
+                WHERE user_id = ?
+                AND day >= ?
+                AND day < ?
+                GROUP BY day
                 ORDER BY expense_date
             """
-            async with db.execute(query, (user_id, start_date, end_date)) as cursor:
-                return [dict(row) for row in await cursor.fetchall()]
+            async with db.execute(query, (user_id, *self._day_bounds(start_date, end_date))) as cursor:
+                return [DailyTotal(day_text(day), total, count) for day, total, count in await cursor.fetchall()]
 
+    @timed
     async def reset_tables(self):
         """Drop and recreate all tables"""
-        async with aiosqlite.connect(self.db_name) as db:
+        async with self.pool.writer() as db:
             # Drop existing tables in reverse order of dependencies
+            await db.execute('DROP TABLE IF EXISTS fsm_states')
+            await db.execute('DROP TABLE IF EXISTS budgets')
+            await db.execute('DROP TABLE IF EXISTS daily_totals')
+            await db.execute('DROP TABLE IF EXISTS monthly_totals')
             await db.execute('DROP TABLE IF EXISTS expenses')
             await db.execute('DROP TABLE IF EXISTS categories')
             await db.execute('DROP TABLE IF EXISTS users')
+            await db.execute('DROP TABLE IF EXISTS schema_version')
             await db.commit()
-            
-            # Recreate tables
-            await self.create_tables()
+
+            # Recreate tables; on empty tables no backfill is left pending
+            await self.migrations.apply(db)
+        self._user_ids.clear()
+        self._categories.clear()
+        self._budgets.clear()
+        self._version_counter += 1
+        self._base_version = self._version_counter
+        self._data_versions.clear()
+
+def shard_for(telegram_id: int, shard_count: int) -> int:
+    """Shard holding a Telegram user's data; stable across processes and restarts"""
+    digest = hashlib.blake2b(str(telegram_id).encode(), digest_size=8).digest()
+    return int.from_bytes(digest, "big") % shard_count
+
+def shard_path(db_name: str, shard: int, shard_count: int) -> str:
+    """File name of one shard, e.g. data/personal_expenses.shard-0-of-4.db"""
+    base, extension = os.path.splitext(db_name)
+    return f"{base}.shard-{shard}-of-{shard_count}{extension}"
+
+class ShardedDatabase:
+    """Database split into shard_count SQLite files by telegram_id.
+
+    Exposes the same methods as Database. User ids handed out are
+    local_id * shard_count + shard, so every later call carrying a user id
+    is routed to the shard that issued it; category and expense ids are
+    only ever used together with their user id and stay shard-local.
+    Only the shards in owned are opened, which lets several worker
+    processes split the shards between them.
+    """
+
+    def __init__(
+        self,
+        db_name: str = "data/personal_expenses.db",
+        shard_count: int = 2,
+        owned: Optional[Iterable[int]] = None,
+        **options: Any
+    ):
+        self.db_name = db_name
+        self.shard_count = shard_count
+        owned = range(shard_count) if owned is None else owned
+        self.shards: Dict[int, Database] = {
+            shard: Database(shard_path(db_name, shard, shard_count), **options)
+            for shard in sorted(owned)
+        }
+        self.timezone = pytz.timezone(options.get('timezone', DEFAULT_TIMEZONE))
+        self._query_observer: Optional[Callable[[str, float], None]] = None
+
+    @property
+    def query_observer(self) -> Optional[Callable[[str, float], None]]:
+        return self._query_observer
+
+    @query_observer.setter
+    def query_observer(self, observer: Optional[Callable[[str, float], None]]):
+        self._query_observer = observer
+        for shard in self.shards.values():
+            shard.query_observer = observer
+
+    @property
+    def pools(self) -> List[ConnectionPool]:
+        return [shard.pool for shard in self.shards.values()]
+
+    def _shard(self, shard: int) -> Database:
+        try:
+            return self.shards[shard]
+        except KeyError:
+            raise RuntimeError(f"Shard {shard} is not owned by this process") from None
+
+    def _route(self, user_id: int) -> Tuple[Database, int]:
+        return self._shard(user_id % self.shard_count), user_id // self.shard_count
+
+    def pool_for(self, telegram_id: int) -> ConnectionPool:
+        """Connection pool of the shard holding the Telegram user's data.
+
+        Users of shards owned by another worker only reach this process
+        through broadcast commands (/reset_db); their FSM state is kept in
+        the first owned shard instead of failing the update.
+        """
+        shard = self.shards.get(shard_for(telegram_id, self.shard_count))
+        if shard is None:
+            shard = next(iter(self.shards.values()))
+        return shard.pool
+
+    async def connect(self):
+        await asyncio.gather(*(shard.connect() for shard in self.shards.values()))
+
+    async def close(self):
+        await asyncio.gather(*(shard.close() for shard in self.shards.values()))
+
+    async def create_tables(self, backfill: bool = True):
+        await asyncio.gather(*(shard.create_tables(backfill) for shard in self.shards.values()))
+
+    async def run_backfills(self):
+        await asyncio.gather(*(shard.run_backfills() for shard in self.shards.values()))
+
+    async def rebuild_rollups(self):
+        await asyncio.gather(*(shard.rebuild_rollups() for shard in self.shards.values()))
+
+    async def reset_tables(self):
+        """Drop and recreate all tables on every owned shard"""
+        await asyncio.gather(*(shard.reset_tables() for shard in self.shards.values()))
+
+    async def get_or_create_user(self, telegram_id: int) -> int:
+        shard = shard_for(telegram_id, self.shard_count)
+        local_id = await self._shard(shard).get_or_create_user(telegram_id)
+        return local_id * self.shard_count + shard
+
+    async def initialize_categories(self, user_id: int):
+        shard, local_id = self._route(user_id)
+        await shard.initialize_categories(local_id)
+
+    async def add_expense(self, user_id: int, amount: int, category_id: int, description: str = None) -> bool:
+        shard, local_id = self._route(user_id)
+        return await shard.add_expense(local_id, amount, category_id, description)
+
+    async def add_expenses(self, rows: List[Tuple]) -> int:
+        by_shard = defaultdict(list)
+        for user_id, *values in rows:
+            shard, local_id = self._route(user_id)
+            by_shard[shard].append((local_id, *values))
+        counts = await asyncio.gather(*(shard.add_expenses(shard_rows) for shard, shard_rows in by_shard.items()))
+        return sum(counts)
+
+    def data_version(self, user_id: int) -> int:
+        shard, local_id = self._route(user_id)
+        return shard.data_version(local_id)
+
+    async def add_categories(self, user_id: int, names: Iterable[str]) -> List[Category]:
+        shard, local_id = self._route(user_id)
+        return await shard.add_categories(local_id, names)
+
+    def invalidate_categories(self, user_id: int):
+        shard, local_id = self._route(user_id)
+        shard.invalidate_categories(local_id)
+
+    async def get_categories(self, user_id: int) -> List[Category]:
+        shard, local_id = self._route(user_id)
+        return await shard.get_categories(local_id)
+
+    async def get_category_by_id(self, category_id: int, user_id: int) -> Optional[Category]:
+        shard, local_id = self._route(user_id)
+        return await shard.get_category_by_id(category_id, local_id)
+
+    async def set_budget(self, user_id: int, category_id: int, amount: int):
+        shard, local_id = self._route(user_id)
+        await shard.set_budget(local_id, category_id, amount)
+
+    async def clear_budget(self, user_id: int, category_id: int) -> bool:
+        shard, local_id = self._route(user_id)
+        return await shard.clear_budget(local_id, category_id)
+
+    async def get_budgets(self, user_id: int) -> List[Budget]:
+        shard, local_id = self._route(user_id)
+        return await shard.get_budgets(local_id)
+
+    async def get_budget(self, user_id: int, category_id: int) -> Optional[Budget]:
+        shard, local_id = self._route(user_id)
+        return await shard.get_budget(local_id, category_id)
+
+    async def get_expenses(self, user_id: int, limit: int = 10) -> List[Expense]:
+        shard, local_id = self._route(user_id)
+        return await shard.get_expenses(local_id, limit)
+
+    async def get_monthly_summary(self, user_id: int, start_date: str = None, end_date: str = None) -> List[CategoryTotal]:
+        shard, local_id = self._route(user_id)
+        return await shard.get_monthly_summary(local_id, start_date, end_date)
+
+    async def get_daily_summary(self, user_id: int) -> List[DailyTotal]:
+        shard, local_id = self._route(user_id)
+        return await shard.get_daily_summary(local_id)
+
+    async def get_expenses_by_date_range(self, user_id: int, start_date: str, end_date: str) -> List[Expense]:
+        shard, local_id = self._route(user_id)
+        return await shard.get_expenses_by_date_range(local_id, start_date, end_date)
+
+    async def iter_expenses(self, user_id: int, *args: Any, **kwargs: Any) -> AsyncIterator[List[Tuple]]:
+        shard, local_id = self._route(user_id)
+        async for rows in shard.iter_expenses(local_id, *args, **kwargs):
+            yield rows
+
+    async def get_expenses_page(self, user_id: int, *args: Any, **kwargs: Any) -> Tuple[List[Expense], bool]:
+        shard, local_id = self._route(user_id)
+        return await shard.get_expenses_page(local_id, *args, **kwargs)
+
+    async def get_report_data(self, user_id: int, start_date: str, end_date: str) -> Dict[str, list]:
+        shard, local_id = self._route(user_id)
+        return await shard.get_report_data(local_id, start_date, end_date)
+
+    async def get_category_summary_by_date_range(self, user_id: int, start_date: str, end_date: str) -> List[CategoryTotal]:
+        shard, local_id = self._route(user_id)
+        return await shard.get_category_summary_by_date_range(local_id, start_date, end_date)
+
+    async def get_daily_summary_by_date_range(self, user_id: int, start_date: str, end_date: str) -> List[DailyTotal]:
+        shard, local_id = self._route(user_id)
+        return await shard.get_daily_summary_by_date_range(local_id, start_date, end_date)
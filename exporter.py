@@ -0,0 +1,72 @@
+"""Streaming CSV/JSONL expense export.
+
+Rows are read from the database in batches, encoded batch by batch and
+appended to a spool file, so memory use does not grow with the size of
+the exported range. The file is then uploaded from disk.
+"""
+import asyncio
+import csv
+import gzip
+import json
+from typing import IO, List, Optional, Tuple
+
+from database import Database
+
+FORMATS = ("csv", "jsonl")
+BATCH_SIZE = 1000
+# Same column titles as the Excel report, so exported CSVs can be imported back
+CSV_HEADER = ["Sana", "Miqdor (so'm)", "Kategoriya", "Izoh"]
+JSONL_KEYS = ("date", "amount", "category", "description")
+
+
+def _open(path: str, compress: bool) -> IO[str]:
+    if compress:
+        return gzip.open(path, "wt", encoding="utf-8", newline="")
+    # BOM so Excel detects UTF-8 when the CSV is opened directly
+    return open(path, "w", encoding="utf-8-sig", newline="")
+
+
+def _write_csv(output: IO[str], writer, rows: List[Tuple]):
+    writer.writerows(rows)
+
+
+def _write_jsonl(output: IO[str], writer, rows: List[Tuple]):
+    output.write("".join(json.dumps(dict(zip(JSONL_KEYS, row)), ensure_ascii=False) + "\n" for row in rows))
+
+
+def export_filename(start_date: Optional[str], end_date: str, fmt: str, compress: bool) -> str:
+    start = start_date or "boshidan"
+    return f"xarajatlar_{start}_{end_date}.{fmt}" + (".gz" if compress else "")
+
+
+async def export_expenses(
+    db: Database,
+    user_id: int,
+    path: str,
+    start_date: Optional[str],
+    end_date: str,
+    fmt: str = "csv",
+    compress: bool = False,
+    batch_size: int = BATCH_SIZE
+) -> int:
+    """Write the user's expenses in the range to path; returns the row count.
+
+    start_date may be None to export everything up to end_date. Encoding
+    and file writes run in a worker thread one batch at a time.
+    """
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown export format: {fmt}")
+    write = _write_csv if fmt == "csv" else _write_jsonl
+
+    count = 0
+    output = await asyncio.to_thread(_open, path, compress)
+    try:
+        writer = csv.writer(output) if fmt == "csv" else None
+        if writer is not None:
+            await asyncio.to_thread(writer.writerow, CSV_HEADER)
+        async for rows in db.iter_expenses(user_id, start_date, end_date, batch_size):
+            await asyncio.to_thread(write, output, writer, rows)
+            count += len(rows)
+    finally:
+        await asyncio.to_thread(output.close)
+    return count
@@ -0,0 +1,232 @@
+"""Bulk expense import from CSV and XLSX files.
+
+Files are read row by row (csv reader / openpyxl read-only mode) in a
+worker thread, validated into batches and inserted one executemany
+transaction per batch, so a large file is never held in memory at once.
+"""
+import asyncio
+import csv
+import os
+import re
+from datetime import date, datetime
+from typing import Any, Awaitable, Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+from zipfile import BadZipFile
+
+from database import Database
+
+SUPPORTED_EXTENSIONS = (".csv", ".xlsx", ".xlsm")
+BATCH_SIZE = 5000
+# Rejected rows kept for the report sent back to the user
+MAX_REJECTED = 1000
+
+# Header text (lower case) -> field; the bot's own Excel report headers are accepted
+COLUMN_ALIASES = {
+    "sana": "date", "date": "date",
+    "miqdor": "amount", "miqdor (so'm)": "amount", "summa": "amount", "amount": "amount",
+    "kategoriya": "category", "category": "category",
+    "izoh": "description", "description": "description"
+}
+# Column order assumed when the file has no header row
+DEFAULT_COLUMNS = ("date", "amount", "category", "description")
+DATE_FORMATS = ("%d.%m.%Y %H:%M", "%d.%m.%Y", "%Y-%m-%d %H:%M:%S", "%Y-%m-%d %H:%M", "%Y-%m-%d", "%d/%m/%Y")
+
+# (line number, date, amount, category name, description)
+ParsedRow = Tuple[int, str, int, str, Optional[str]]
+# (line number, reason, original cells)
+RejectedRow = Tuple[int, str, List[Any]]
+
+
+class ImportResult:
+    """Outcome of one import"""
+
+    def __init__(self):
+        self.read = 0
+        self.imported = 0
+        self.rejected_count = 0
+        self.rejected: List[RejectedRow] = []
+        self.created_categories: List[str] = []
+
+    def reject(self, row: RejectedRow):
+        self.rejected_count += 1
+        if len(self.rejected) < MAX_REJECTED:
+            self.rejected.append(row)
+
+
+def category_key(name: str) -> str:
+    """Match key for category names: case-insensitive, leading emoji ignored"""
+    return re.sub(r"^\W+", "", name.strip().lower())
+
+
+def parse_amount(value: Any) -> int:
+    if isinstance(value, bool):
+        raise ValueError(value)
+    if isinstance(value, (int, float)):
+        amount = value
+    else:
+        text = str(value).lower().replace("so'm", "").replace("\xa0", "").replace(" ", "").replace(",", "")
+        amount = float(text)
+    if amount <= 0 or amount != amount or amount == float("inf"):
+        raise ValueError(value)
+    return round(amount)
+
+
+def parse_date(value: Any) -> str:
+    if isinstance(value, datetime):
+        return value.strftime('%Y-%m-%d %H:%M:%S')
+    if isinstance(value, date):
+        return value.strftime('%Y-%m-%d 00:00:00')
+    text = str(value).strip()
+    for date_format in DATE_FORMATS:
+        try:
+            return datetime.strptime(text, date_format).strftime('%Y-%m-%d %H:%M:%S')
+        except ValueError:
+            pass
+    raise ValueError(value)
+
+
+def _read_csv(path: str) -> Iterator[Sequence[Any]]:
+    with open(path, newline="", encoding="utf-8-sig") as source:
+        sample = source.read(64 * 1024)
+        source.seek(0)
+        try:
+            dialect = csv.Sniffer().sniff(sample, delimiters=",;\t")
+        except csv.Error:
+            dialect = csv.excel
+        yield from csv.reader(source, dialect)
+
+
+def _read_xlsx(path: str) -> Iterator[Sequence[Any]]:
+    from openpyxl import load_workbook
+    from openpyxl.utils.exceptions import InvalidFileException
+
+    try:
+        workbook = load_workbook(path, read_only=True, data_only=True)
+    except (BadZipFile, InvalidFileException) as e:
+        # E.g. a CSV or text file renamed to .xlsx
+        raise ValueError(f"Not a valid XLSX file: {e}") from e
+    try:
+        yield from workbook.worksheets[0].iter_rows(values_only=True)
+    finally:
+        workbook.close()
+
+
+def read_rows(path: str, filename: str) -> Iterator[Sequence[Any]]:
+    """Rows of the first sheet (XLSX) or the whole file (CSV), one at a time"""
+    extension = os.path.splitext(filename)[1].lower()
+    if extension == ".csv":
+        return _read_csv(path)
+    if extension in (".xlsx", ".xlsm"):
+        return _read_xlsx(path)
+    raise ValueError(f"Unsupported file type: {extension}")
+
+
+def parse_batches(
+    rows: Iterator[Sequence[Any]],
+    batch_size: int = BATCH_SIZE
+) -> Iterator[Tuple[List[ParsedRow], List[RejectedRow]]]:
+    """Validate raw rows and yield them as (valid, rejected) batches"""
+    columns: Dict[str, int] = {}
+    valid: List[ParsedRow] = []
+    rejected: List[RejectedRow] = []
+
+    for line_number, cells in enumerate(rows, 1):
+        cells = ["" if cell is None else cell for cell in cells]
+        if not any(str(cell).strip() for cell in cells):
+            continue
+
+        if not columns:
+            header = {
+                COLUMN_ALIASES[str(cell).strip().lower()]: index
+                for index, cell in enumerate(cells)
+                if str(cell).strip().lower() in COLUMN_ALIASES
+            }
+            if header:
+                if not {"date", "amount", "category"} <= header.keys():
+                    raise ValueError("Header must name the date, amount and category columns")
+                columns = header
+                continue
+            columns = {field: index for index, field in enumerate(DEFAULT_COLUMNS)}
+
+        def cell(field: str) -> Any:
+            index = columns.get(field)
+            return cells[index] if index is not None and index < len(cells) else ""
+
+        try:
+            expense_date = parse_date(cell("date"))
+        except ValueError:
+            rejected.append((line_number, "Noto'g'ri sana", list(cells)))
+        else:
+            try:
+                amount = parse_amount(cell("amount"))
+            except ValueError:
+                rejected.append((line_number, "Noto'g'ri miqdor", list(cells)))
+            else:
+                category = str(cell("category")).strip()
+                description = str(cell("description")).strip() or None
+                if category:
+                    valid.append((line_number, expense_date, amount, category, description))
+                else:
+                    rejected.append((line_number, "Kategoriya ko'rsatilmagan", list(cells)))
+
+        if len(valid) + len(rejected) >= batch_size:
+            yield valid, rejected
+            valid, rejected = [], []
+
+    if valid or rejected:
+        yield valid, rejected
+
+
+async def import_expenses(
+    db: Database,
+    user_id: int,
+    path: str,
+    filename: str,
+    progress: Optional[Callable[[ImportResult], Awaitable[None]]] = None,
+    batch_size: int = BATCH_SIZE
+) -> ImportResult:
+    """Import a CSV/XLSX file for the user; missing categories are created.
+
+    Parsing runs in a worker thread one batch at a time; each batch is
+    stored in its own transaction and progress is awaited after it.
+    """
+    result = ImportResult()
+    batches = parse_batches(read_rows(path, filename), batch_size)
+    categories = {category_key(category.name): category.id for category in await db.get_categories(user_id)}
+    try:
+        while True:
+            batch = await asyncio.to_thread(next, batches, None)
+            if batch is None:
+                break
+            valid, rejected = batch
+            result.read += len(valid) + len(rejected)
+            for row in rejected:
+                result.reject(row)
+
+            missing = {}
+            for row in valid:
+                key = category_key(row[3])
+                if key not in categories:
+                    missing.setdefault(key, row[3])
+            if missing:
+                for category in await db.add_categories(user_id, missing.values()):
+                    categories.setdefault(category_key(category.name), category.id)
+                result.created_categories.extend(missing.values())
+
+            result.imported += await db.add_expenses([
+                (user_id, amount, categories[category_key(category)], description, expense_date)
+                for _, expense_date, amount, category, description in valid
+            ])
+            if progress is not None:
+                await progress(result)
+    finally:
+        batches.close()
+    return result
+
+
+def write_rejected(result: ImportResult, path: str):
+    """Write the kept rejected rows as CSV: line, reason, then the original cells"""
+    with open(path, "w", newline="", encoding="utf-8-sig") as output:
+        writer = csv.writer(output)
+        writer.writerow(["Qator", "Sabab", "Ma'lumot"])
+        for line_number, reason, cells in result.rejected:
+            writer.writerow([line_number, reason, *cells])
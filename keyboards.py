@@ -1,9 +1,12 @@
 from aiogram.types import ReplyKeyboardMarkup, KeyboardButton, InlineKeyboardMarkup, InlineKeyboardButton
-from typing import List, Dict
+from typing import List, Optional, Tuple
 
-def get_main_keyboard() -> ReplyKeyboardMarkup:
-    """Main menu keyboard"""
-    keyboard = [
+from cache import LRUCache
+from records import Budget, Category
+
+# Built once and reused; aiogram only serializes markup when sending
+_MAIN_KEYBOARD = ReplyKeyboardMarkup(
+    keyboard=[
         [
             KeyboardButton(text="💰 Xarajat qo'shish"),
             KeyboardButton(text="📊 Oylik hisobot")
@@ -13,46 +16,156 @@ def get_main_keyboard() -> ReplyKeyboardMarkup:
             KeyboardButton(text="📈 Kunlik statistika")
         ],
         [
-            KeyboardButton(text="📊 Excel hisobot")
+            KeyboardButton(text="📊 Excel hisobot"),
+            KeyboardButton(text="🎯 Byudjetlar")
+        ]
+    ],
+    resize_keyboard=True
+)
+
+_REPORT_PERIOD_KEYBOARD = InlineKeyboardMarkup(
+    inline_keyboard=[
+        [
+            InlineKeyboardButton(text="📅 Hafta", callback_data="report_week"),
+            InlineKeyboardButton(text="📅 Oy", callback_data="report_month")
+        ],
+        [
+            InlineKeyboardButton(text="📅 Yil", callback_data="report_year"),
+            InlineKeyboardButton(text="📅 Boshqa davr", callback_data="report_custom")
+        ],
+        [
+            InlineKeyboardButton(text="📤 CSV / JSONL eksport", callback_data="exmenu")
+        ],
+        [
+            InlineKeyboardButton(text="❌ Bekor qilish", callback_data="cancel")
+        ]
+    ]
+)
+
+_EXPORT_FORMAT_KEYBOARD = InlineKeyboardMarkup(
+    inline_keyboard=[
+        [
+            InlineKeyboardButton(text="📄 CSV", callback_data="exfmt_csv"),
+            InlineKeyboardButton(text="🗜 CSV (gzip)", callback_data="exfmt_csv.gz")
+        ],
+        [
+            InlineKeyboardButton(text="📄 JSONL", callback_data="exfmt_jsonl"),
+            InlineKeyboardButton(text="🗜 JSONL (gzip)", callback_data="exfmt_jsonl.gz")
+        ],
+        [
+            InlineKeyboardButton(text="❌ Bekor qilish", callback_data="cancel")
         ]
     ]
-    return ReplyKeyboardMarkup(keyboard=keyboard, resize_keyboard=True)
+)
+
+# Export format -> period selection keyboard for that format
+_EXPORT_PERIOD_KEYBOARDS = {
+    export_format: InlineKeyboardMarkup(
+        inline_keyboard=[
+            [
+                InlineKeyboardButton(text="📅 Hafta", callback_data=f"export_{export_format}_week"),
+                InlineKeyboardButton(text="📅 Oy", callback_data=f"export_{export_format}_month")
+            ],
+            [
+                InlineKeyboardButton(text="📅 Yil", callback_data=f"export_{export_format}_year"),
+                InlineKeyboardButton(text="📅 Barcha vaqt", callback_data=f"export_{export_format}_all")
+            ],
+            [
+                InlineKeyboardButton(text="❌ Bekor qilish", callback_data="cancel")
+            ]
+        ]
+    )
+    for export_format in ("csv", "csv.gz", "jsonl", "jsonl.gz")
+}
+
+_CANCEL_KEYBOARD = InlineKeyboardMarkup(
+    inline_keyboard=[[
+        InlineKeyboardButton(text="❌ Bekor qilish", callback_data="cancel")
+    ]]
+)
+
+# (callback prefix, (category id, name) pairs) -> built markup, so each category set is built once
+_categories_keyboards = LRUCache(1024)
+
+def get_main_keyboard() -> ReplyKeyboardMarkup:
+    """Main menu keyboard"""
+    return _MAIN_KEYBOARD
+
+def get_categories_keyboard(categories: List[Category], prefix: str = "category") -> InlineKeyboardMarkup:
+    """Categories selection keyboard; buttons send {prefix}_{category id}"""
+    key = (prefix, tuple((cat.id, cat.name) for cat in categories))
+    markup = _categories_keyboards.get(key)
+    if markup is not None:
+        return markup
 
-def get_categories_keyboard(categories: List[Dict]) -> InlineKeyboardMarkup:
-    """Categories selection keyboard"""
     keyboard = []
     row = []
     for i, cat in enumerate(categories):
         row.append(InlineKeyboardButton(
-            text=cat["name"],
-            callback_data=f"category_{cat['id']}"
+            text=cat.name,
+            callback_data=f"{prefix}_{cat.id}"
         ))
         if len(row) == 2 or i == len(categories) - 1:
             keyboard.append(row)
             row = []
+    markup = InlineKeyboardMarkup(inline_keyboard=keyboard)
+    _categories_keyboards.set(key, markup)
+    return markup
+
+def get_page_keyboard(prev_data: Optional[str], next_data: Optional[str]) -> Optional[InlineKeyboardMarkup]:
+    """Previous/next page navigation keyboard; buttons without data are left out"""
+    row = []
+    if prev_data:
+        row.append(InlineKeyboardButton(text="⬅️ Oldingi", callback_data=prev_data))
+    if next_data:
+        row.append(InlineKeyboardButton(text="Keyingi ➡️", callback_data=next_data))
+    return InlineKeyboardMarkup(inline_keyboard=[row]) if row else None
+
+def get_history_keyboard(newer_data: Optional[str], older_data: Optional[str], filters: str) -> InlineKeyboardMarkup:
+    """History browser keyboard: page navigation plus filter buttons"""
+    keyboard = []
+    row = []
+    if newer_data:
+        row.append(InlineKeyboardButton(text="⬅️ Yangiroq", callback_data=newer_data))
+    if older_data:
+        row.append(InlineKeyboardButton(text="Eskiroq ➡️", callback_data=older_data))
+    if row:
+        keyboard.append(row)
+    keyboard.append([
+        InlineKeyboardButton(text="📁 Kategoriya", callback_data=f"hcat_{filters}"),
+        InlineKeyboardButton(text="📅 Davr", callback_data=f"hdate_{filters}")
+    ])
     return InlineKeyboardMarkup(inline_keyboard=keyboard)
 
-def get_report_period_keyboard() -> InlineKeyboardMarkup:
-    """Report period selection keyboard"""
+def get_history_filter_keyboard(options: List[Tuple[str, str]]) -> InlineKeyboardMarkup:
+    """Filter choices for the history browser as (text, callback data) pairs"""
     keyboard = [
-        [
-            InlineKeyboardButton(text="📅 Hafta", callback_data="report_week"),
-            InlineKeyboardButton(text="📅 Oy", callback_data="report_month")
-        ],
-        [
-            InlineKeyboardButton(text="📅 Yil", callback_data="report_year"),
-            InlineKeyboardButton(text="📅 Boshqa davr", callback_data="report_custom")
-        ],
-        [
-            InlineKeyboardButton(text="❌ Bekor qilish", callback_data="cancel")
-        ]
+        [InlineKeyboardButton(text=text, callback_data=data) for text, data in options[i:i + 2]]
+        for i in range(0, len(options), 2)
     ]
     return InlineKeyboardMarkup(inline_keyboard=keyboard)
 
+def get_budgets_keyboard(budgets: List[Budget]) -> InlineKeyboardMarkup:
+    """Budget list keyboard: add/change a budget, and one remove button per budget"""
+    keyboard = [[InlineKeyboardButton(text="➕ Byudjet qo'yish", callback_data="bset")]]
+    keyboard.extend(
+        [InlineKeyboardButton(text=f"❌ {budget.category_name}", callback_data=f"bclear_{budget.category_id}")]
+        for budget in budgets
+    )
+    return InlineKeyboardMarkup(inline_keyboard=keyboard)
+
+def get_report_period_keyboard() -> InlineKeyboardMarkup:
+    """Report period selection keyboard"""
+    return _REPORT_PERIOD_KEYBOARD
+
+def get_export_format_keyboard() -> InlineKeyboardMarkup:
+    """CSV/JSONL export format selection keyboard"""
+    return _EXPORT_FORMAT_KEYBOARD
+
+def get_export_period_keyboard(export_format: str) -> InlineKeyboardMarkup:
+    """Export period selection keyboard for the chosen format"""
+    return _EXPORT_PERIOD_KEYBOARDS[export_format]
+
 def get_cancel_keyboard() -> InlineKeyboardMarkup:
     """Cancel operation keyboard"""
-    return InlineKeyboardMarkup(
-        inline_keyboard=[[
-            InlineKeyboardButton(text="❌ Bekor qilish", callback_data="cancel")
-        ]]
-    )
+    return _CANCEL_KEYBOARD
@@ -1,17 +1,31 @@
 import asyncio
 import logging
 import os
+import tempfile
+import time
 from datetime import datetime, timedelta
 from aiogram import Bot, Dispatcher, types, F
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
 from aiogram.filters import Command, StateFilter
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
-from aiogram.fsm.storage.memory import MemoryStorage
 from dotenv import load_dotenv
 
-from database import Database
-from keyboards import get_main_keyboard, get_categories_keyboard, get_cancel_keyboard, get_report_period_keyboard
-from reports import generate_excel_report
+from database import Database, ShardedDatabase
+from records import Budget, Expense
+from storage import SQLiteStorage
+from keyboards import (
+    get_main_keyboard, get_categories_keyboard, get_cancel_keyboard, get_report_period_keyboard, get_page_keyboard,
+    get_history_keyboard, get_history_filter_keyboard, get_export_format_keyboard, get_export_period_keyboard,
+    get_budgets_keyboard
+)
+from rendering import ReportRenderer, ReportBusyError
+from cache import ReportCache
+import exporter
+import importer
+import metrics
+import outbound
 
 # Load environment variables
 load_dotenv()
@@ -20,9 +34,56 @@ load_dotenv()
 logging.basicConfig(level=logging.INFO)
 
 # Initialize bot and dispatcher
-bot = Bot(token=os.getenv("BOT_TOKEN"))
-dp = Dispatcher(storage=MemoryStorage())
-db = Database()
+# BOT_API_URL points the bot at a local Bot API server (or a fake one in tests)
+if os.getenv("BOT_API_URL"):
+    bot = Bot(
+        token=os.getenv("BOT_TOKEN"),
+        session=AiohttpSession(api=TelegramAPIServer.from_base(os.getenv("BOT_API_URL")))
+    )
+else:
+    bot = Bot(token=os.getenv("BOT_TOKEN"))
+# With DB_SHARDS > 1 users are spread over several SQLite files; under the
+# supervisor each worker process opens only the shards it was given
+DB_SHARDS = int(os.getenv("DB_SHARDS", "1"))
+BOT_WORKERS = int(os.getenv("BOT_WORKERS", "1"))
+BOT_WORKER_INDEX = int(os.getenv("BOT_WORKER_INDEX", "0"))
+# Every call aimed at a chat goes through the rate-limited outbound queue.
+# The global limit is bot-wide, so each worker process gets its share of it;
+# a chat is always served by one worker, so the per-chat limits stay as set
+outbound_scheduler = outbound.OutboundScheduler(
+    global_rate=float(os.getenv("OUTBOUND_GLOBAL_RATE", "30")) / BOT_WORKERS,
+    chat_rate=float(os.getenv("OUTBOUND_CHAT_RATE", "1")),
+    chat_burst=float(os.getenv("OUTBOUND_CHAT_BURST", "3"))
+)
+bot.session.middleware(outbound_scheduler)
+# Day and month boundaries of every report are taken in this timezone
+TIMEZONE = os.getenv("TIMEZONE", "Asia/Tashkent")
+if DB_SHARDS > 1:
+    db = ShardedDatabase(
+        shard_count=DB_SHARDS,
+        owned=[shard for shard in range(DB_SHARDS) if shard % BOT_WORKERS == BOT_WORKER_INDEX],
+        timezone=TIMEZONE
+    )
+else:
+    db = Database(timezone=TIMEZONE)
+dp = Dispatcher(storage=SQLiteStorage(
+    db,
+    ttl=float(os.getenv("FSM_TTL_HOURS", "24")) * 60 * 60,
+    cache_size=int(os.getenv("FSM_CACHE_SIZE", "10000"))
+))
+report_renderer = ReportRenderer(
+    kind=os.getenv("REPORT_EXECUTOR", "thread"),
+    workers=int(os.getenv("REPORT_WORKERS", "2")),
+    timeout=float(os.getenv("REPORT_TIMEOUT", "60"))
+)
+report_cache = ReportCache(max_bytes=int(os.getenv("REPORT_CACHE_MB", "64")) * 1024 * 1024)
+
+# Latency metrics; nothing is hooked in unless enabled
+if os.getenv("METRICS_ENABLED", "0") == "1":
+    metrics.enable()
+    db.query_observer = metrics.observe_query
+    dp.message.middleware(metrics.HandlerTimingMiddleware())
+    dp.callback_query.middleware(metrics.HandlerTimingMiddleware())
 
 # Get allowed users from env
 ALLOWED_USER_IDS = {
@@ -45,11 +106,31 @@ class ExpenseStates(StatesGroup):
     waiting_for_custom_start_date = State()
     waiting_for_custom_end_date = State()
     waiting_for_month = State()
+    waiting_for_import_file = State()
+    waiting_for_budget_amount = State()
 
 def format_number(number: int) -> str:
     """Format number with thousand separators"""
     return f"{number:,}".replace(",", " ")
 
+# Share of a monthly budget at which the expense confirmation warns
+BUDGET_ALERT_PERCENT = int(os.getenv("BUDGET_ALERT_PERCENT", "80"))
+
+def format_budget_status(budget: Budget, amount: int) -> str:
+    """Budget lines for the confirmation of an expense of amount in the budget's category"""
+    remaining = budget.amount - budget.spent
+    text = f"\n\n🎯 Oylik byudjet: {format_number(budget.spent)} / {format_number(budget.amount)} so'm\n"
+    if remaining < 0:
+        text += f"🚨 Byudjetdan {format_number(-remaining)} so'm oshib ketdi!"
+        return text
+
+    text += f"💵 Qoldi: {format_number(remaining)} so'm"
+    # Warn once, on the expense that crosses the threshold
+    threshold = budget.amount * BUDGET_ALERT_PERCENT / 100
+    if budget.spent - amount < threshold <= budget.spent:
+        text += f"\n⚠️ Byudjetning {BUDGET_ALERT_PERCENT}% qismi ishlatildi."
+    return text
+
 async def check_user_access(message: types.Message) -> bool:
     """Check if user is allowed to use the bot"""
     if not message.from_user:
@@ -109,6 +190,10 @@ async def cmd_help(message: types.Message):
         "2️⃣ Hisobotlar:\n"
         "   • \"📊 Oylik hisobot\" - oylik xarajatlar hisoboti\n"
         "   • \"📊 Excel hisobot\" - Excel formatdagi batafsil hisobot\n\n"
+        "3️⃣ Import:\n"
+        "   • /import - CSV yoki XLSX fayldan xarajatlarni yuklash\n\n"
+        "4️⃣ Byudjetlar:\n"
+        "   • \"🎯 Byudjetlar\" yoki /budgets - kategoriyalar uchun oylik limitlar\n\n"
         "❓ Savollar bo'lsa, /help buyrug'idan foydalaning.",
         reply_markup=get_main_keyboard()
     )
@@ -203,14 +288,17 @@ async def process_description(message: types.Message, state: FSMContext):
 
     await db.add_expense(user_id, amount, category_id, description)
     category = await db.get_category_by_id(category_id, user_id)
-    
-    await message.answer(
+    budget = await db.get_budget(user_id, category_id)
+
+    text = (
         f"✅ Xarajat qo'shildi:\n"
         f"💰 {format_number(amount)} so'm\n"
-        f"📁 {category['name']}\n"
-        f"📝 {description if description else 'Izohsiz'}",
-        reply_markup=get_main_keyboard()
+        f"📁 {category.name}\n"
+        f"📝 {description if description else 'Izohsiz'}"
     )
+    if budget is not None:
+        text += format_budget_status(budget, amount)
+    await message.answer(text, reply_markup=get_main_keyboard())
     await state.clear()
 
 @dp.message(F.text == "📊 Oylik hisobot")
@@ -221,7 +309,7 @@ async def monthly_report(message: types.Message):
 
     # Create keyboard with current and past 6 months
     buttons = []
-    current_date = datetime.now()
+    current_date = datetime.now(db.timezone)
     
     # Get last 7 months correctly
     for i in range(7):
@@ -253,6 +341,76 @@ async def monthly_report(message: types.Message):
         reply_markup=types.InlineKeyboardMarkup(inline_keyboard=buttons)
     )
 
+def month_range(year: int, month: int) -> tuple[datetime, datetime]:
+    """First and last day of a month"""
+    start_date = datetime(year, month, 1)
+    if month == 12:
+        end_date = datetime(year + 1, 1, 1) - timedelta(days=1)
+    else:
+        end_date = datetime(year, month + 1, 1) - timedelta(days=1)
+    return start_date, end_date
+
+def format_expense(expense: Expense) -> str:
+    """Format a single expense entry for detailed listings"""
+    date = datetime.fromisoformat(expense.date.replace('Z', '+00:00'))
+    return (
+        f"📅 {date.strftime('%d.%m.%Y')}\n"
+        f"💰 {format_number(expense.amount)} so'm\n"
+        f"📁 {expense.category_name}\n"
+        f"📝 {expense.description if expense.description else 'Izohsiz'}\n"
+    )
+
+def encode_cursor(expense: Expense) -> str:
+    """(date, id) keyset cursor packed for callback data"""
+    date = datetime.fromisoformat(expense.date).strftime('%Y%m%d%H%M%S')
+    return f"{date}_{expense.id}"
+
+def decode_cursor(date: str, expense_id: str) -> tuple[str, int]:
+    return datetime.strptime(date, '%Y%m%d%H%M%S').strftime('%Y-%m-%d %H:%M:%S'), int(expense_id)
+
+MONTH_PAGE_SIZE = 10
+
+async def show_month_page(
+    message: types.Message,
+    user_id: int,
+    year: int,
+    month: int,
+    page: int = 1,
+    cursor: tuple[str, int] = None,
+    backward: bool = False,
+    edit: bool = False
+) -> bool:
+    """Send (or edit in place) one page of a month's detailed expenses"""
+    start_date, end_date = month_range(year, month)
+    expenses, has_more = await db.get_expenses_page(
+        user_id,
+        start_date.strftime('%Y-%m-%d'),
+        end_date.strftime('%Y-%m-%d'),
+        cursor=cursor,
+        backward=backward,
+        limit=MONTH_PAGE_SIZE
+    )
+    if not expenses:
+        return False
+
+    if backward:
+        has_prev, has_next = has_more, True
+    else:
+        has_prev, has_next = cursor is not None, has_more
+
+    text = f"📝 Batafsil xarajatlar ({start_date.strftime('%B %Y')}), {page}-sahifa:\n\n"
+    text += f"{'─' * 20}\n".join(format_expense(expense) for expense in expenses)
+    keyboard = get_page_keyboard(
+        f"mpage_{year}-{month}_{page - 1}_b_{encode_cursor(expenses[0])}" if has_prev else None,
+        f"mpage_{year}-{month}_{page + 1}_a_{encode_cursor(expenses[-1])}" if has_next else None
+    )
+
+    if edit:
+        await message.edit_text(text, reply_markup=keyboard)
+    else:
+        await message.answer(text, reply_markup=keyboard)
+    return True
+
 @dp.callback_query(lambda c: c.data.startswith('month_'))
 async def process_month_selection(callback: types.CallbackQuery):
     """Process month selection for report"""
@@ -262,24 +420,17 @@ async def process_month_selection(callback: types.CallbackQuery):
     # Extract year and month from callback data
     _, year_month = callback.data.split('_')
     year, month = map(int, year_month.split('-'))
-    
-    # Calculate start and end dates for the selected month
-    start_date = datetime(year, month, 1)
-    if month == 12:
-        end_date = datetime(year + 1, 1, 1) - timedelta(days=1)
-    else:
-        end_date = datetime(year, month + 1, 1) - timedelta(days=1)
+    start_date, end_date = month_range(year, month)
 
     user_id = await db.get_or_create_user(callback.from_user.id)
-    
-    # Get both summary and detailed expenses
+
+    # Summary comes from the rollups; details are paged on demand
     summary = await db.get_monthly_summary(user_id, start_date.strftime('%Y-%m-%d'), end_date.strftime('%Y-%m-%d'))
-    expenses = await db.get_expenses_by_date_range(user_id, start_date.strftime('%Y-%m-%d'), end_date.strftime('%Y-%m-%d'))
-    
+
     # Delete message with keyboard
     await callback.message.delete()
-    
-    if not summary and not expenses:
+
+    if not summary:
         await callback.message.answer(
             f"📅 {start_date.strftime('%B %Y')} oyida xarajatlar yo'q.",
             reply_markup=get_main_keyboard()
@@ -288,46 +439,119 @@ async def process_month_selection(callback: types.CallbackQuery):
         return
 
     # First show the summary
-    total = sum(item["total_amount"] for item in summary)
+    total = sum(item.total_amount for item in summary)
+    count = sum(item.count for item in summary)
     report = f"📊 {start_date.strftime('%B %Y')} oyi uchun hisobot:\n\n"
-    
+
     for item in summary:
-        percentage = (item["total_amount"] / total) * 100
+        percentage = (item.total_amount / total) * 100
         report += (
-            f"{item['category_name']}: {format_number(item['total_amount'])} so'm\n"
+            f"{item.category_name}: {format_number(item.total_amount)} so'm\n"
             f"({percentage:.1f}%)\n\n"
         )
-    
-    report += f"\n💰 Jami: {format_number(total)} so'm\n"
-    report += "\n📝 Batafsil xarajatlar:\n"
 
-    # Then show detailed expenses
-    for expense in expenses:
-        date = datetime.fromisoformat(expense['date'].replace('Z', '+00:00'))
-        report += (
-            f"\n📅 {date.strftime('%d.%m.%Y')}\n"
-            f"💰 {format_number(expense['amount'])} so'm\n"
-            f"📁 {expense['category_name']}\n"
-            f"📝 {expense['description'] if expense['description'] else 'Izohsiz'}\n"
-            f"{'─' * 20}\n"
+    report += f"\n💰 Jami: {format_number(total)} so'm ({count} ta xarajat)\n"
+    chunks = outbound.split_text(report)
+    with outbound.bulk():
+        for i, chunk in enumerate(chunks):
+            await callback.message.answer(chunk, reply_markup=get_main_keyboard() if i == len(chunks) - 1 else None)
+
+    # Then the first page of detailed expenses
+    await show_month_page(callback.message, user_id, year, month)
+    await callback.answer()
+
+@dp.callback_query(lambda c: c.data.startswith('mpage_'))
+async def process_month_page(callback: types.CallbackQuery):
+    """Move to the previous/next page of a monthly report"""
+    if not await check_callback_user_access(callback):
+        return
+
+    _, year_month, page, direction, date, expense_id = callback.data.split('_')
+    year, month = map(int, year_month.split('-'))
+    user_id = await db.get_or_create_user(callback.from_user.id)
+
+    shown = await show_month_page(
+        callback.message,
+        user_id,
+        year,
+        month,
+        page=int(page),
+        cursor=decode_cursor(date, expense_id),
+        backward=direction == "b",
+        edit=True
+    )
+    if shown:
+        await callback.answer()
+    else:
+        await callback.answer("Boshqa xarajatlar yo'q.")
+
+HISTORY_PAGE_SIZE = 10
+
+# (button text, days back) for the history period filter
+HISTORY_PERIODS = [
+    ("📅 Oxirgi 7 kun", 7),
+    ("📅 Oxirgi 30 kun", 30),
+    ("📅 Oxirgi 365 kun", 365)
+]
+
+def parse_history_filters(category_id: str, start: str, end: str) -> tuple:
+    """Decode the category_start_end filter part of history callback data; 0 means not set"""
+    def day(value: str):
+        return None if value == "0" else datetime.strptime(value, '%Y%m%d').strftime('%Y-%m-%d')
+    return int(category_id) or None, day(start), day(end)
+
+async def show_history_page(
+    message: types.Message,
+    user_id: int,
+    filters: str = "0_0_0",
+    cursor: tuple[str, int] = None,
+    older: bool = True,
+    edit: bool = False
+):
+    """Send (or edit in place) one page of expense history, newest first"""
+    category_id, start_date, end_date = parse_history_filters(*filters.split('_'))
+    expenses, has_more = await db.get_expenses_page(
+        user_id,
+        start_date,
+        end_date,
+        cursor=cursor,
+        backward=older,
+        limit=HISTORY_PAGE_SIZE,
+        category_id=category_id
+    )
+
+    if older:
+        has_newer, has_older = cursor is not None, has_more
+    else:
+        has_newer, has_older = has_more, True
+
+    header = "📋 So'nggi xarajatlar"
+    if category_id:
+        category = await db.get_category_by_id(category_id, user_id)
+        header += f"\n📁 {category.name if category else 'Kategoriya topilmadi'}"
+    if start_date or end_date:
+        header += (
+            f"\n📅 {datetime.fromisoformat(start_date).strftime('%d.%m.%Y') if start_date else '...'}"
+            f" - {datetime.fromisoformat(end_date).strftime('%d.%m.%Y') if end_date else '...'}"
         )
-    
-    # Send in chunks if too long
-    if len(report) > 4000:
-        chunks = [report[i:i+4000] for i in range(0, len(report), 4000)]
-        for chunk in chunks:
-            await callback.message.answer(chunk)
-        await callback.message.answer(
-            "✅ Hisobot tugadi.",
-            reply_markup=get_main_keyboard()
+
+    if expenses:
+        text = f"{header}:\n\n" + f"{'─' * 20}\n".join(format_expense(expense) for expense in reversed(expenses))
+        keyboard = get_history_keyboard(
+            f"hist_{filters}_n_{encode_cursor(expenses[-1])}" if has_newer else None,
+            f"hist_{filters}_o_{encode_cursor(expenses[0])}" if has_older else None,
+            filters
         )
+    elif filters != "0_0_0" or cursor is not None:
+        text = f"{header}:\n\nTanlangan filtr bo'yicha xarajatlar yo'q."
+        keyboard = get_history_keyboard(None, None, filters)
     else:
-        await callback.message.answer(
-            report,
-            reply_markup=get_main_keyboard()
-        )
-    
-    await callback.answer()
+        text, keyboard = "Hali xarajatlar yo'q.", None
+
+    if edit:
+        await message.edit_text(text, reply_markup=keyboard)
+    else:
+        await message.answer(text, reply_markup=keyboard)
 
 @dp.message(F.text == "📋 So'nggi xarajatlar")
 async def recent_expenses(message: types.Message):
@@ -336,22 +560,60 @@ async def recent_expenses(message: types.Message):
         return
 
     user_id = await db.get_or_create_user(message.from_user.id)
-    expenses = await db.get_expenses(user_id, 10)
-    if not expenses:
-        await message.answer("Hali xarajatlar yo'q.")
+    await show_history_page(message, user_id)
+
+@dp.callback_query(lambda c: c.data.startswith('hist_'))
+async def process_history_page(callback: types.CallbackQuery):
+    """Browse expense history: hist_{category}_{start}_{end}[_{o|n}_{cursor}]"""
+    if not await check_callback_user_access(callback):
         return
 
-    report = "📋 So'nggi xarajatlar:\n\n"
-    for expense in expenses:
-        date = datetime.fromisoformat(expense["date"]).strftime("%d.%m.%Y")
-        report += (
-            f"📅 {date}\n"
-            f"💰 {format_number(expense['amount'])} so'm\n"
-            f"📁 {expense['category_name']}\n"
-            f"📝 {expense['description'] if expense['description'] else 'Izohsiz'}\n\n"
-        )
-    
-    await message.answer(report)
+    parts = callback.data.split('_')
+    filters = "_".join(parts[1:4])
+    cursor = decode_cursor(parts[5], parts[6]) if len(parts) == 7 else None
+    user_id = await db.get_or_create_user(callback.from_user.id)
+
+    await show_history_page(
+        callback.message,
+        user_id,
+        filters,
+        cursor=cursor,
+        older=len(parts) != 7 or parts[4] == "o",
+        edit=True
+    )
+    await callback.answer()
+
+@dp.callback_query(lambda c: c.data.startswith('hcat_'))
+async def process_history_category_filter(callback: types.CallbackQuery):
+    """Choose the category filter of the history browser"""
+    if not await check_callback_user_access(callback):
+        return
+
+    _, _, start, end = callback.data.split('_')
+    user_id = await db.get_or_create_user(callback.from_user.id)
+    categories = await db.get_categories(user_id)
+
+    options = [("📋 Barchasi", f"hist_0_{start}_{end}")]
+    options += [(category.name, f"hist_{category.id}_{start}_{end}") for category in categories]
+    await callback.message.edit_text("Kategoriyani tanlang:", reply_markup=get_history_filter_keyboard(options))
+    await callback.answer()
+
+@dp.callback_query(lambda c: c.data.startswith('hdate_'))
+async def process_history_period_filter(callback: types.CallbackQuery):
+    """Choose the period filter of the history browser"""
+    if not await check_callback_user_access(callback):
+        return
+
+    _, category_id, _, _ = callback.data.split('_')
+    today = datetime.now(db.timezone)
+
+    options = [
+        (text, f"hist_{category_id}_{(today - timedelta(days=days)).strftime('%Y%m%d')}_{today.strftime('%Y%m%d')}")
+        for text, days in HISTORY_PERIODS
+    ]
+    options.append(("📋 Barcha vaqt", f"hist_{category_id}_0_0"))
+    await callback.message.edit_text("Davrni tanlang:", reply_markup=get_history_filter_keyboard(options))
+    await callback.answer()
 
 @dp.message(F.text == "📈 Kunlik statistika")
 async def daily_stats(message: types.Message):
@@ -367,8 +629,8 @@ async def daily_stats(message: types.Message):
 
     report = "📈 So'nggi 7 kunlik statistika:\n\n"
     for stat in stats:
-        date = datetime.fromisoformat(stat["expense_date"]).strftime("%d.%m.%Y")
-        report += f"📅 {date}: {format_number(stat['total_amount'])} so'm\n"
+        date = datetime.fromisoformat(stat.expense_date).strftime("%d.%m.%Y")
+        report += f"📅 {date}: {format_number(stat.total_amount)} so'm\n"
     
     await message.answer(report)
 
@@ -393,7 +655,7 @@ async def process_report_period(callback: types.CallbackQuery, state: FSMContext
     user_id = await db.get_or_create_user(callback.from_user.id)
     
     # Calculate date range based on period
-    end_date = datetime.now()
+    end_date = datetime.now(db.timezone)
     
     if period == "custom":
         await state.update_data(user_id=user_id)  
@@ -424,6 +686,82 @@ async def process_report_period(callback: types.CallbackQuery, state: FSMContext
     )
     await callback.answer()
 
+# Telegram bots cannot upload files larger than this
+MAX_EXPORT_FILE_SIZE = 50 * 1024 * 1024
+# Users with an export being written; one at a time per user
+exports_in_flight = set()
+
+@dp.callback_query(F.data == "exmenu")
+async def export_menu(callback: types.CallbackQuery):
+    """Show CSV/JSONL export format choices"""
+    if not await check_callback_user_access(callback):
+        return
+
+    await callback.message.edit_text("Eksport formatini tanlang:", reply_markup=get_export_format_keyboard())
+    await callback.answer()
+
+@dp.callback_query(lambda c: c.data.startswith('exfmt_'))
+async def process_export_format(callback: types.CallbackQuery):
+    """Ask for the export period once the format is chosen"""
+    if not await check_callback_user_access(callback):
+        return
+
+    export_format = callback.data.split('_')[1]
+    await callback.message.edit_text(
+        "Qaysi davr uchun eksport kerak?",
+        reply_markup=get_export_period_keyboard(export_format)
+    )
+    await callback.answer()
+
+@dp.callback_query(lambda c: c.data.startswith('export_'))
+async def process_export(callback: types.CallbackQuery):
+    """Stream the user's expenses for the period into a CSV/JSONL file and send it"""
+    if not await check_callback_user_access(callback):
+        return
+
+    _, export_format, period = callback.data.split('_')
+    fmt, _, compression = export_format.partition('.')
+    user_id = await db.get_or_create_user(callback.from_user.id)
+
+    end_date = datetime.now(db.timezone)
+    days = {"week": 7, "month": 30, "year": 365}.get(period)
+    start_date = (end_date - timedelta(days=days)).strftime('%Y-%m-%d') if days else None
+    end_date = end_date.strftime('%Y-%m-%d')
+
+    if user_id in exports_in_flight:
+        await callback.answer("⏳ Oldingi eksport hali tayyorlanmoqda.")
+        return
+    exports_in_flight.add(user_id)
+    await callback.message.delete()
+    await callback.answer()
+
+    filename = exporter.export_filename(start_date, end_date, fmt, bool(compression))
+    try:
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, filename)
+            count = await exporter.export_expenses(
+                db, user_id, path, start_date, end_date, fmt=fmt, compress=bool(compression)
+            )
+            if not count:
+                await callback.message.answer("Bu davr uchun xarajatlar topilmadi.", reply_markup=get_main_keyboard())
+                return
+            if os.path.getsize(path) > MAX_EXPORT_FILE_SIZE:
+                await callback.message.answer(
+                    "❌ Fayl juda katta. Gzip formatini yoki qisqaroq davrni tanlang.",
+                    reply_markup=get_main_keyboard()
+                )
+                return
+
+            start = datetime.fromisoformat(start_date).strftime("%d.%m.%Y") if start_date else "boshidan"
+            with outbound.bulk():
+                await callback.message.answer_document(
+                    types.FSInputFile(path, filename=filename),
+                    caption=f"📤 Eksport: {start} - {datetime.fromisoformat(end_date).strftime('%d.%m.%Y')} ({count} ta xarajat)",
+                    reply_markup=get_main_keyboard()
+                )
+    finally:
+        exports_in_flight.discard(user_id)
+
 @dp.message(StateFilter(ExpenseStates.waiting_for_custom_start_date))
 async def process_custom_start_date(message: types.Message, state: FSMContext):
     """Process custom start date"""
@@ -472,34 +810,238 @@ async def process_custom_end_date(message: types.Message, state: FSMContext):
 
 async def generate_report(message: types.Message, user_id: int, start_date: str, end_date: str):
     """Generate and send Excel report"""
-    # Get data for report
-    expenses = await db.get_expenses_by_date_range(user_id, start_date, end_date)
-    if not expenses:
+    async def build_report():
+        # Get data for report
+        report_data = await db.get_report_data(user_id, start_date, end_date)
+        if not report_data["expenses"]:
+            return None
+
+        # Generate Excel file in memory, off the event loop
+        return await report_renderer.render(
+            user_id,
+            expenses=report_data["expenses"],
+            category_summary=report_data["category_summary"],
+            daily_summary=report_data["daily_summary"],
+            start_date=start_date,
+            end_date=end_date
+        )
+
+    # Unchanged data for the same range is served from the cache
+    cache_key = (user_id, start_date, end_date, db.data_version(user_id))
+    try:
+        report = await report_cache.get_or_create(cache_key, build_report)
+    except ReportBusyError:
+        await message.answer(
+            "⏳ Oldingi hisobot hali tayyorlanmoqda. Iltimos, biroz kuting.",
+            reply_markup=get_main_keyboard()
+        )
+        return
+    except asyncio.TimeoutError:
+        await message.answer(
+            "❌ Hisobot tayyorlash juda uzoq davom etdi. Iltimos, qisqaroq davr tanlang.",
+            reply_markup=get_main_keyboard()
+        )
+        return
+
+    if report is None:
         await message.answer("Bu davr uchun xarajatlar topilmadi.", reply_markup=get_main_keyboard())
         return
+    excel_data, filename = report
 
-    category_summary = await db.get_category_summary_by_date_range(user_id, start_date, end_date)
-    daily_summary = await db.get_daily_summary_by_date_range(user_id, start_date, end_date)
-    
-    # Generate Excel file in memory
-    excel_data, filename = generate_excel_report(
-        expenses=expenses,
-        category_summary=category_summary,
-        daily_summary=daily_summary,
-        start_date=start_date,
-        end_date=end_date
-    )
-    
     # Format dates for message
     start = datetime.fromisoformat(start_date).strftime("%d.%m.%Y")
     end = datetime.fromisoformat(end_date).strftime("%d.%m.%Y")
     
     # Send file from memory
-    await message.answer_document(
-        types.BufferedInputFile(excel_data, filename=filename),
-        caption=f"📊 Hisobot: {start} - {end}",
-        reply_markup=get_main_keyboard()
+    with outbound.bulk():
+        await message.answer_document(
+            types.BufferedInputFile(excel_data, filename=filename),
+            caption=f"📊 Hisobot: {start} - {end}",
+            reply_markup=get_main_keyboard()
+        )
+
+# Telegram bots cannot download files larger than this
+MAX_IMPORT_FILE_SIZE = 20 * 1024 * 1024
+
+def format_budgets(budgets: list[Budget]) -> str:
+    if not budgets:
+        return "🎯 Hali byudjet qo'yilmagan.\n\nKategoriya uchun oylik limit qo'yish uchun \"➕ Byudjet qo'yish\" tugmasini bosing."
+
+    text = "🎯 Oylik byudjetlar:\n\n"
+    for budget in budgets:
+        remaining = budget.amount - budget.spent
+        text += (
+            f"{budget.category_name}: {format_number(budget.spent)} / {format_number(budget.amount)} so'm"
+            f" ({budget.spent * 100 // budget.amount}%)\n"
+        )
+        if remaining < 0:
+            text += f"   🚨 {format_number(-remaining)} so'm oshib ketdi\n"
+        else:
+            text += f"   💵 Qoldi: {format_number(remaining)} so'm\n"
+    return text
+
+@dp.message(F.text == "🎯 Byudjetlar")
+@dp.message(Command("budgets"))
+async def show_budgets(message: types.Message):
+    """List the user's monthly category budgets"""
+    if not await check_user_access(message):
+        return
+
+    user_id = await db.get_or_create_user(message.from_user.id)
+    budgets = await db.get_budgets(user_id)
+    await message.answer(format_budgets(budgets), reply_markup=get_budgets_keyboard(budgets))
+
+@dp.callback_query(F.data == "bset")
+async def process_budget_set(callback: types.CallbackQuery):
+    """Choose the category to set a budget for"""
+    if not await check_callback_user_access(callback):
+        return
+
+    user_id = await db.get_or_create_user(callback.from_user.id)
+    categories = await db.get_categories(user_id)
+    await callback.message.edit_text(
+        "Byudjet qo'yiladigan kategoriyani tanlang:",
+        reply_markup=get_categories_keyboard(categories, prefix="bcat")
     )
+    await callback.answer()
+
+@dp.callback_query(lambda c: c.data.startswith("bcat_"))
+async def process_budget_category(callback: types.CallbackQuery, state: FSMContext):
+    """Ask for the monthly limit of the chosen category"""
+    if not await check_callback_user_access(callback):
+        return
+
+    category_id = int(callback.data.split('_')[1])
+    user_id = await db.get_or_create_user(callback.from_user.id)
+    category = await db.get_category_by_id(category_id, user_id)
+    if category is None:
+        await callback.answer("Kategoriya topilmadi")
+        return
+
+    await state.update_data(budget_category_id=category_id)
+    await state.set_state(ExpenseStates.waiting_for_budget_amount)
+    await callback.message.edit_text(
+        f"{category.name} uchun oylik limitni kiriting (so'm):",
+        reply_markup=get_cancel_keyboard()
+    )
+    await callback.answer()
+
+@dp.message(StateFilter(ExpenseStates.waiting_for_budget_amount))
+async def process_budget_amount(message: types.Message, state: FSMContext):
+    """Save the monthly limit"""
+    if not await check_user_access(message):
+        return
+
+    try:
+        amount = int(message.text.replace(" ", ""))
+        if amount <= 0:
+            raise ValueError("Amount must be positive")
+    except (ValueError, TypeError, AttributeError):
+        await message.answer(
+            "Noto'g'ri format. Iltimos, faqat raqamlardan foydalaning.\n"
+            "Masalan: 1000000",
+            reply_markup=get_cancel_keyboard()
+        )
+        return
+
+    data = await state.get_data()
+    user_id = await db.get_or_create_user(message.from_user.id)
+    await db.set_budget(user_id, data["budget_category_id"], amount)
+    await state.clear()
+
+    budgets = await db.get_budgets(user_id)
+    await message.answer("✅ Byudjet saqlandi.", reply_markup=get_main_keyboard())
+    await message.answer(format_budgets(budgets), reply_markup=get_budgets_keyboard(budgets))
+
+@dp.callback_query(lambda c: c.data.startswith("bclear_"))
+async def process_budget_clear(callback: types.CallbackQuery):
+    """Remove a category's budget"""
+    if not await check_callback_user_access(callback):
+        return
+
+    user_id = await db.get_or_create_user(callback.from_user.id)
+    await db.clear_budget(user_id, int(callback.data.split('_')[1]))
+    budgets = await db.get_budgets(user_id)
+    await callback.message.edit_text(format_budgets(budgets), reply_markup=get_budgets_keyboard(budgets))
+    await callback.answer("Byudjet o'chirildi")
+
+@dp.message(Command("import"))
+async def cmd_import(message: types.Message, state: FSMContext):
+    """Start a bulk import from a CSV/XLSX file"""
+    if not await check_user_access(message):
+        return
+
+    await state.set_state(ExpenseStates.waiting_for_import_file)
+    await message.answer(
+        "📥 CSV yoki XLSX faylni yuboring.\n\n"
+        "Ustunlar: Sana, Miqdor, Kategoriya, Izoh (sarlavha qatori ixtiyoriy).\n"
+        "Sana: DD.MM.YYYY yoki YYYY-MM-DD. Mavjud bo'lmagan kategoriyalar yaratiladi.",
+        reply_markup=get_cancel_keyboard()
+    )
+
+@dp.message(StateFilter(ExpenseStates.waiting_for_import_file), F.document)
+async def process_import_file(message: types.Message, state: FSMContext):
+    """Import expenses from the uploaded file"""
+    if not await check_user_access(message):
+        return
+
+    document = message.document
+    filename = document.file_name or ""
+    extension = os.path.splitext(filename)[1].lower()
+    if extension not in importer.SUPPORTED_EXTENSIONS:
+        await message.answer("Faqat CSV yoki XLSX fayl yuboring.", reply_markup=get_cancel_keyboard())
+        return
+    if document.file_size and document.file_size > MAX_IMPORT_FILE_SIZE:
+        await message.answer("Fayl juda katta (20 MB dan oshmasligi kerak).", reply_markup=get_cancel_keyboard())
+        return
+
+    await state.clear()
+    user_id = await db.get_or_create_user(message.from_user.id)
+    status = await message.answer("⏳ Fayl yuklanmoqda...")
+    last_update = time.monotonic()
+
+    async def report_progress(result: importer.ImportResult):
+        nonlocal last_update
+        if time.monotonic() - last_update >= 2:
+            last_update = time.monotonic()
+            await status.edit_text(
+                f"⏳ {result.read} qator o'qildi, {result.imported} ta xarajat qo'shildi..."
+            )
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, f"import{extension}")
+        await bot.download(document, destination=path)
+        try:
+            result = await importer.import_expenses(db, user_id, path, filename, progress=report_progress)
+        except (ValueError, UnicodeDecodeError, KeyError, OSError) as e:
+            logging.warning("Import failed for user %s: %s", user_id, e)
+            await status.edit_text(
+                "❌ Faylni o'qib bo'lmadi. Ustunlar Sana, Miqdor, Kategoriya, Izoh bo'lishi kerak."
+            )
+            return
+
+        text = (
+            f"✅ Import tugadi:\n"
+            f"📥 {result.imported} ta xarajat qo'shildi\n"
+            f"⚠️ {result.rejected_count} ta qator rad etildi"
+        )
+        if result.created_categories:
+            text += f"\n📁 Yangi kategoriyalar: {', '.join(result.created_categories)}"
+        await status.edit_text(text)
+
+        if result.rejected:
+            rejected_path = os.path.join(directory, "rejected.csv")
+            importer.write_rejected(result, rejected_path)
+            caption = "Rad etilgan qatorlar"
+            if result.rejected_count > len(result.rejected):
+                caption += f" (birinchi {len(result.rejected)} tasi)"
+            with outbound.bulk():
+                await message.answer_document(types.FSInputFile(rejected_path, filename="rejected.csv"), caption=caption)
+
+@dp.message(StateFilter(ExpenseStates.waiting_for_import_file))
+async def process_import_not_file(message: types.Message):
+    """Remind the user that a file is expected"""
+    await message.answer("Iltimos, CSV yoki XLSX faylni hujjat sifatida yuboring.", reply_markup=get_cancel_keyboard())
 
 @dp.message(Command("reset_db"))
 async def reset_database(message: types.Message):
@@ -508,8 +1050,29 @@ async def reset_database(message: types.Message):
         await message.answer("Bu buyruq faqat administratorlar uchun.")
         return
 
+    # The supervisor sends this command to every worker; each resets its own shards
     await db.reset_tables()
-    await message.answer("Ma'lumotlar bazasi muvaffaqiyatli qayta tiklandi.")
+    if BOT_WORKERS > 1:
+        await message.answer(
+            f"Ma'lumotlar bazasi muvaffaqiyatli qayta tiklandi (worker {BOT_WORKER_INDEX + 1}/{BOT_WORKERS})."
+        )
+    else:
+        await message.answer("Ma'lumotlar bazasi muvaffaqiyatli qayta tiklandi.")
+
+@dp.message(Command("metrics"))
+async def dump_metrics(message: types.Message):
+    """Send current metrics as a file - admin only command"""
+    if not message.from_user or message.from_user.id not in ADMIN_USER_IDS:
+        await message.answer("Bu buyruq faqat administratorlar uchun.")
+        return
+
+    if not metrics.enabled:
+        await message.answer("Metrikalar o'chirilgan (METRICS_ENABLED=1 qiling).")
+        return
+
+    await message.answer_document(
+        types.BufferedInputFile(metrics.render().encode(), filename="metrics.txt")
+    )
 
 @dp.callback_query(F.data == "cancel")
 async def cancel_operation(callback: types.CallbackQuery, state: FSMContext):
@@ -543,11 +1106,52 @@ async def cancel_operation(callback: types.CallbackQuery, state: FSMContext):
     await callback.answer()
 
 async def main():
-    # Initialize database tables
-    await db.create_tables()
-    
-    # Start polling
-    await dp.start_polling(bot)
+    if os.getenv("REPORT_PREWARM", "1") == "1":
+        # Load the reporting stack in the background once the bot is running
+        dp.startup.register(report_renderer.start_prewarm)
+
+    backfill_task = None
+    metrics_runner = None
+    # Setup runs inside the try so a failed start still closes the database;
+    # open aiosqlite connections would otherwise keep the process alive
+    try:
+        # Open database connections and initialize tables
+        await db.connect()
+        await db.create_tables(backfill=False)
+        # Large migrations backfill in batches while the bot is already serving
+        backfill_task = asyncio.create_task(db.run_backfills())
+
+        metrics_port = int(os.getenv("METRICS_PORT", "0"))
+        if metrics.enabled and metrics_port:
+            metrics_runner = await metrics.start_http_server(os.getenv("METRICS_HOST", "127.0.0.1"), metrics_port)
+
+        if os.getenv("BOT_MODE", "polling") == "webhook":
+            from webhook import run_webhook
+            await run_webhook(
+                dp,
+                bot,
+                host=os.getenv("WEBHOOK_HOST", "0.0.0.0"),
+                port=int(os.getenv("WEBHOOK_PORT", "8080")),
+                url=os.getenv("WEBHOOK_URL") or None,
+                path=os.getenv("WEBHOOK_PATH", "/webhook"),
+                secret_token=os.getenv("WEBHOOK_SECRET") or None,
+                max_concurrent=int(os.getenv("WEBHOOK_MAX_CONCURRENT", "100")),
+                drain_timeout=float(os.getenv("WEBHOOK_DRAIN_TIMEOUT", "30"))
+            )
+        else:
+            # Start polling
+            await dp.start_polling(bot)
+    finally:
+        # Progress is committed per batch; an interrupted backfill resumes on the next start
+        if backfill_task is not None:
+            backfill_task.cancel()
+            await asyncio.gather(backfill_task, return_exceptions=True)
+        await outbound_scheduler.close()
+        report_renderer.close()
+        await dp.storage.close()
+        await db.close()
+        if metrics_runner is not None:
+            await metrics_runner.cleanup()
 
 if __name__ == "__main__":
     asyncio.run(main())
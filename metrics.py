@@ -0,0 +1,115 @@
+"""Latency histograms exposed in Prometheus text format.
+
+Collection is off until enable() is called; observe() on a disabled
+histogram returns immediately, so instrumented code paths cost one
+attribute check when metrics are turned off.
+"""
+import time
+from bisect import bisect_left
+from typing import Any, Awaitable, Callable, Dict, List, Sequence
+
+from aiogram import BaseMiddleware
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+SIZE_BUCKETS = (16 * 1024, 64 * 1024, 256 * 1024, 1024 * 1024, 4 * 1024 * 1024, 16 * 1024 * 1024)
+
+enabled = False
+
+class Histogram:
+    """Histogram with one label, rendered with cumulative buckets"""
+
+    def __init__(self, name: str, documentation: str, label: str, buckets: Sequence[float]):
+        self.name = name
+        self.documentation = documentation
+        self.label = label
+        self.buckets = tuple(buckets)
+        # label value -> [per-bucket counts (last is +Inf), sum]
+        self._series: Dict[str, List[Any]] = {}
+
+    def observe(self, label_value: str, value: float):
+        if not enabled:
+            return
+        series = self._series.get(label_value)
+        if series is None:
+            series = self._series[label_value] = [[0] * (len(self.buckets) + 1), 0.0]
+        series[0][bisect_left(self.buckets, value)] += 1
+        series[1] += value
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        for label_value, (counts, total) in sorted(self._series.items()):
+            label = f'{self.label}="{_escape(label_value)}"'
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                lines.append(f'{self.name}_bucket{{{label},le="{le}"}} {cumulative}')
+            lines.append(f"{self.name}_sum{{{label}}} {total}")
+            lines.append(f"{self.name}_count{{{label}}} {cumulative}")
+        return lines
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+HANDLER_SECONDS = Histogram(
+    "bot_handler_seconds", "Time spent in update handlers.", "handler", LATENCY_BUCKETS
+)
+QUERY_SECONDS = Histogram(
+    "bot_query_seconds", "Time spent in Database queries, by method.", "query", LATENCY_BUCKETS
+)
+REPORT_RENDER_SECONDS = Histogram(
+    "bot_report_render_seconds", "Excel report render time.", "executor", LATENCY_BUCKETS
+)
+REPORT_BYTES = Histogram(
+    "bot_report_bytes", "Size of rendered Excel reports.", "executor", SIZE_BUCKETS
+)
+HISTOGRAMS = [HANDLER_SECONDS, QUERY_SECONDS, REPORT_RENDER_SECONDS, REPORT_BYTES]
+
+def enable():
+    global enabled
+    enabled = True
+
+def observe_query(name: str, seconds: float):
+    """Database.query_observer hook"""
+    QUERY_SECONDS.observe(name, seconds)
+
+def render() -> str:
+    """All metrics in Prometheus text exposition format"""
+    lines = []
+    for histogram in HISTOGRAMS:
+        lines.extend(histogram.render())
+    return "\n".join(lines) + "\n"
+
+class HandlerTimingMiddleware(BaseMiddleware):
+    """Inner middleware recording latency per handler function"""
+
+    async def __call__(
+        self,
+        handler: Callable[[Any, Dict[str, Any]], Awaitable[Any]],
+        event: Any,
+        data: Dict[str, Any]
+    ) -> Any:
+        handler_object = data.get("handler")
+        name = getattr(getattr(handler_object, "callback", None), "__name__", "unknown")
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        finally:
+            HANDLER_SECONDS.observe(name, time.perf_counter() - started)
+
+async def start_http_server(host: str, port: int):
+    """Serve /metrics on host:port; returns the runner to clean up on shutdown"""
+    from aiohttp import web
+
+    async def handle_metrics(request: web.Request) -> web.Response:
+        return web.Response(
+            body=render().encode(),
+            headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"}
+        )
+
+    app = web.Application()
+    app.router.add_get("/metrics", handle_metrics)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
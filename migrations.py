@@ -0,0 +1,161 @@
+"""Versioned schema migrations with resumable, batched backfills.
+
+Applied versions are recorded in the schema_version table. A migration's
+schema step (DDL) runs in one transaction together with its version row.
+When it needs existing rows rewritten, the rows present at that moment
+(rowid up to backfill_target) are processed later in batches of
+batch_size, each batch committed together with its position, so the
+writer is released between batches and a crash resumes where it stopped.
+Rows inserted meanwhile are written in their final form by the bot
+itself. finish runs in its own transaction after the last batch (or
+right after the schema step when there is nothing to backfill), e.g. to
+build an index once its column is filled. It is not batched: SQLite
+builds an index in a single statement, so the writer is held for the
+whole build and writes wait meanwhile; its duration is logged.
+"""
+import asyncio
+import logging
+import time
+from typing import Awaitable, Callable, List, NamedTuple, Optional
+
+import aiosqlite
+
+
+class Migration(NamedTuple):
+    version: int
+    name: str
+    # Returns True when existing rows of table need a backfill
+    schema: Callable[[aiosqlite.Connection], Awaitable[bool]]
+    # Processes the rows of table with rowid in (start, stop]
+    backfill: Optional[Callable[[aiosqlite.Connection, int, int], Awaitable[None]]] = None
+    finish: Optional[Callable[[aiosqlite.Connection], Awaitable[None]]] = None
+    table: str = "expenses"
+
+
+class MigrationRunner:
+    def __init__(self, pool, migrations: List[Migration], batch_size: int = 2000, pause: float = 0.0):
+        self.pool = pool
+        self.migrations = sorted(migrations, key=lambda migration: migration.version)
+        self.batch_size = batch_size
+        # Seconds to sleep between batches; 0 still lets other tasks run
+        self.pause = pause
+
+    async def apply(self, db: aiosqlite.Connection) -> List[int]:
+        """Run the schema step of every migration not applied yet (caller holds the writer).
+
+        Returns the versions applied.
+        """
+        await db.execute('''
+            CREATE TABLE IF NOT EXISTS schema_version (
+                version INTEGER PRIMARY KEY,
+                name TEXT NOT NULL,
+                applied_at REAL NOT NULL,
+                backfill_position INTEGER,
+                backfill_target INTEGER,
+                completed_at REAL
+            )
+        ''')
+        await db.commit()
+        cursor = await db.execute("SELECT IFNULL(MAX(version), 0) FROM schema_version")
+        current = (await cursor.fetchone())[0]
+        await cursor.close()
+
+        applied = []
+        for migration in self.migrations:
+            if migration.version <= current:
+                continue
+            # Explicit BEGIN so the DDL is rolled back with the version row on failure
+            await db.execute("BEGIN")
+            target = 0
+            if await migration.schema(db) and migration.backfill is not None:
+                cursor = await db.execute(f"SELECT IFNULL(MAX(rowid), 0) FROM {migration.table}")
+                target = (await cursor.fetchone())[0]
+                await cursor.close()
+            now = time.time()
+            if target:
+                await db.execute(
+                    "INSERT INTO schema_version (version, name, applied_at, backfill_position, backfill_target) "
+                    "VALUES (?, ?, ?, 0, ?)",
+                    (migration.version, migration.name, now, target)
+                )
+            else:
+                if migration.finish is not None:
+                    await migration.finish(db)
+                await db.execute(
+                    "INSERT INTO schema_version (version, name, applied_at, completed_at) VALUES (?, ?, ?, ?)",
+                    (migration.version, migration.name, now, now)
+                )
+            await db.commit()
+            applied.append(migration.version)
+            logging.info("Applied migration %d (%s)%s", migration.version, migration.name,
+                         f"; backfilling {target} rows" if target else "")
+        return applied
+
+    async def pending(self) -> List[int]:
+        """Versions whose backfill has not completed"""
+        async with self.pool.reader() as db:
+            async with db.execute(
+                "SELECT version FROM schema_version WHERE completed_at IS NULL ORDER BY version"
+            ) as cursor:
+                return [row[0] for row in await cursor.fetchall()]
+
+    async def backfill(self):
+        """Run the pending backfills in version order, one batch per writer transaction"""
+        for migration in self.migrations:
+            if migration.backfill is None:
+                continue
+            try:
+                await self._backfill(migration)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logging.exception("Backfill of migration %d (%s) failed", migration.version, migration.name)
+                raise
+
+    async def _backfill(self, migration: Migration):
+        started = None
+        while True:
+            async with self.pool.writer() as db:
+                # Re-read every batch: reset_tables may have recreated the schema meanwhile
+                cursor = await db.execute(
+                    "SELECT backfill_position, backfill_target FROM schema_version "
+                    "WHERE version = ? AND completed_at IS NULL",
+                    (migration.version,)
+                )
+                row = await cursor.fetchone()
+                await cursor.close()
+                if row is None:
+                    break
+                position, target = row
+                if started is None:
+                    started = time.perf_counter()
+                    logging.info("Backfilling migration %d (%s) from row %d of %d",
+                                 migration.version, migration.name, position, target)
+
+                if position >= target:
+                    # Separate from the last batch so its commit is not held back
+                    if migration.finish is not None:
+                        finish_started = time.perf_counter()
+                        await migration.finish(db)
+                        logging.info("Finished migration %d (%s) in %.1f s; writes waited meanwhile",
+                                     migration.version, migration.name, time.perf_counter() - finish_started)
+                    await db.execute(
+                        "UPDATE schema_version SET completed_at = ? WHERE version = ?",
+                        (time.time(), migration.version)
+                    )
+                    await db.commit()
+                    continue
+
+                stop = min(position + self.batch_size, target)
+                await migration.backfill(db, position, stop)
+                await db.execute(
+                    "UPDATE schema_version SET backfill_position = ? WHERE version = ?",
+                    (stop, migration.version)
+                )
+                await db.commit()
+            # Let handlers and queued writes use the writer between batches
+            await asyncio.sleep(self.pause)
+
+        if started is not None:
+            logging.info("Migration %d (%s) backfilled in %.1f s",
+                         migration.version, migration.name, time.perf_counter() - started)
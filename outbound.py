@@ -0,0 +1,256 @@
+"""Central scheduler for outgoing Bot API calls.
+
+Installed as an aiogram request middleware, it queues every call aimed at
+a chat (send*, edit*, delete*) and releases them through a global token
+bucket and one bucket per chat, so bursts are smoothed out before
+Telegram's flood limits kick in. A chat has at most one call in flight,
+which keeps its messages in order. RetryAfter pauses the chat and puts
+the call back at the front of its queue instead of retrying at once.
+
+Calls made inside ``with bulk():`` (report chunks, files) wait behind
+interactive ones.
+"""
+import asyncio
+import contextlib
+import contextvars
+import itertools
+import logging
+from collections import deque
+from typing import Any, Deque, Dict, Iterator, List, Optional, Set
+
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import TelegramMethod
+
+from cache import LRUCache
+
+MESSAGE_LIMIT = 4096
+INTERACTIVE = 0
+BULK = 1
+
+_priority: contextvars.ContextVar[int] = contextvars.ContextVar("outbound_priority", default=INTERACTIVE)
+
+
+@contextlib.contextmanager
+def bulk() -> Iterator[None]:
+    """Send the Bot API calls made in this block at bulk priority"""
+    token = _priority.set(BULK)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+def split_text(text: str, limit: int = MESSAGE_LIMIT) -> List[str]:
+    """Split text into chunks of at most limit characters, on line breaks where possible"""
+    chunks = []
+    current = ""
+    for line in text.splitlines(keepends=True):
+        while len(line) > limit:
+            if current:
+                chunks.append(current)
+                current = ""
+            chunks.append(line[:limit])
+            line = line[limit:]
+        if len(current) + len(line) > limit:
+            chunks.append(current)
+            current = ""
+        current += line
+    if current:
+        chunks.append(current)
+    return [chunk.rstrip("\n") for chunk in chunks if chunk.strip()]
+
+
+class TokenBucket:
+    """rate tokens per second, holding at most capacity"""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated: Optional[float] = None
+
+    def _refill(self, now: float):
+        if self.updated is not None:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def ready_at(self, now: float) -> float:
+        """Loop time at which a token will be available"""
+        self._refill(now)
+        return now if self.tokens >= 1 else now + (1 - self.tokens) / self.rate
+
+    def take(self, now: float):
+        self._refill(now)
+        self.tokens -= 1
+
+
+class _Call:
+    __slots__ = ("method", "make_request", "bot", "priority", "seq", "future", "retries")
+
+    def __init__(self, method, make_request, bot, priority: int, seq: int, future: asyncio.Future):
+        self.method = method
+        self.make_request = make_request
+        self.bot = bot
+        self.priority = priority
+        self.seq = seq
+        self.future = future
+        self.retries = 0
+
+
+class _Chat:
+    __slots__ = ("queues", "busy", "paused_until")
+
+    def __init__(self):
+        # One FIFO per priority
+        self.queues: List[Deque[_Call]] = [deque(), deque()]
+        self.busy = False
+        self.paused_until = 0.0
+
+    def head(self) -> Optional[_Call]:
+        for queue in self.queues:
+            while queue and queue[0].future.done():
+                queue.popleft()
+            if queue:
+                return queue[0]
+        return None
+
+
+class OutboundScheduler(BaseRequestMiddleware):
+    """Rate-limiting, prioritising request middleware (see module docstring)"""
+
+    def __init__(
+        self,
+        global_rate: float = 30.0,
+        chat_rate: float = 1.0,
+        chat_burst: float = 3.0,
+        max_retries: int = 3
+    ):
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.max_retries = max_retries
+        self._global = TokenBucket(global_rate, global_rate)
+        # chat_id -> bucket; kept after the chat's queue empties so its rate still applies
+        self._buckets = LRUCache(10000)
+        self._chats: Dict[Any, _Chat] = {}
+        self._seq = itertools.count()
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        # In-flight sends; referenced so they are not garbage-collected mid-request
+        self._sends: Set[asyncio.Task] = set()
+
+    async def __call__(self, make_request: NextRequestMiddlewareType, bot, method: TelegramMethod):
+        chat_id = getattr(method, "chat_id", None)
+        if chat_id is None:
+            # getUpdates, answerCallbackQuery, inline edits, ...
+            return await make_request(bot, method)
+
+        future = asyncio.get_running_loop().create_future()
+        call = _Call(method, make_request, bot, _priority.get(), next(self._seq), future)
+        chat = self._chats.get(chat_id)
+        if chat is None:
+            chat = self._chats[chat_id] = _Chat()
+        chat.queues[call.priority].append(call)
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+        self._wakeup.set()
+        return await future
+
+    def _bucket(self, chat_id: Any) -> TokenBucket:
+        bucket = self._buckets.get(chat_id)
+        if bucket is None:
+            bucket = TokenBucket(self.chat_rate, self.chat_burst)
+            self._buckets.set(chat_id, bucket)
+        return bucket
+
+    async def _run(self):
+        """Release queued calls; returns once every chat has drained"""
+        loop = asyncio.get_running_loop()
+        while True:
+            now = loop.time()
+            best = None
+            wait = None
+            for chat_id, chat in list(self._chats.items()):
+                call = chat.head()
+                if call is None:
+                    if not chat.busy:
+                        del self._chats[chat_id]
+                    continue
+                if chat.busy:
+                    continue
+                ready_at = max(self._bucket(chat_id).ready_at(now), chat.paused_until)
+                if ready_at > now:
+                    wait = ready_at - now if wait is None else min(wait, ready_at - now)
+                elif best is None or (call.priority, call.seq) < (best[2].priority, best[2].seq):
+                    best = (chat_id, chat, call)
+
+            if best is None:
+                if not self._chats:
+                    # Drained chats were just removed; nothing left to wait for
+                    return
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), wait)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            delay = self._global.ready_at(now) - now
+            if delay > 0:
+                await asyncio.sleep(delay)
+                continue
+
+            chat_id, chat, call = best
+            self._global.take(now)
+            self._bucket(chat_id).take(now)
+            chat.busy = True
+            chat.queues[call.priority].popleft()
+            task = asyncio.create_task(self._send(chat, call))
+            self._sends.add(task)
+            task.add_done_callback(self._sends.discard)
+
+    async def _send(self, chat: _Chat, call: _Call):
+        try:
+            response = await call.make_request(call.bot, call.method)
+        except asyncio.CancelledError:
+            call.future.cancel()
+            raise
+        except TelegramRetryAfter as e:
+            chat.paused_until = asyncio.get_running_loop().time() + e.retry_after
+            call.retries += 1
+            if call.retries > self.max_retries:
+                if not call.future.done():
+                    call.future.set_exception(e)
+            else:
+                logging.warning("Flood limit for chat %s; retrying in %s s", call.method.chat_id, e.retry_after)
+                chat.queues[call.priority].appendleft(call)
+        except Exception as e:
+            if not call.future.done():
+                call.future.set_exception(e)
+        else:
+            if not call.future.done():
+                call.future.set_result(response)
+        finally:
+            chat.busy = False
+            self._wakeup.set()
+
+    async def close(self, timeout: float = 10.0):
+        """Give queued calls up to timeout seconds to go out, then drop them"""
+        if self._task is None:
+            return
+        # Wake the loop so it notices drained queues right away
+        self._wakeup.set()
+        try:
+            await asyncio.wait_for(asyncio.shield(self._task), timeout)
+        except asyncio.TimeoutError:
+            self._task.cancel()
+            for task in self._sends:
+                task.cancel()
+            for chat in self._chats.values():
+                for queue in chat.queues:
+                    for call in queue:
+                        call.future.cancel()
+            self._chats.clear()
+        # Finished or cancelled above; wait so no send outlives the session
+        await asyncio.gather(self._task, *self._sends, return_exceptions=True)
+        self._task = None
@@ -0,0 +1,39 @@
+"""Row types returned by Database queries.
+
+Rows come straight from the cursor as tuples and are wrapped without any
+per-row dict; fields are read by attribute (expense.amount).
+"""
+from typing import NamedTuple, Optional
+
+
+class Category(NamedTuple):
+    id: int
+    name: str
+
+
+class Expense(NamedTuple):
+    id: int
+    date: str
+    amount: int
+    category_name: Optional[str]
+    description: Optional[str]
+
+
+class CategoryTotal(NamedTuple):
+    category_name: Optional[str]
+    count: int
+    total_amount: int
+
+
+class DailyTotal(NamedTuple):
+    expense_date: str
+    total_amount: int
+    count: int
+
+
+class Budget(NamedTuple):
+    category_id: int
+    category_name: Optional[str]
+    # Monthly limit and the current month's spending so far
+    amount: int
+    spent: int
@@ -0,0 +1,118 @@
+import asyncio
+import logging
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import List, Set
+
+import metrics
+from records import CategoryTotal, DailyTotal, Expense
+
+
+def _render(*args) -> tuple[bytes, str]:
+    # reports pulls in openpyxl, so it is imported on first use rather than at startup
+    from reports import generate_excel_report
+    return generate_excel_report(*args)
+
+
+def _warm_up():
+    import reports  # noqa: F401
+
+
+class ReportBusyError(Exception):
+    """The user already has a report being rendered"""
+
+
+class ReportRenderer:
+    """Render Excel reports in a bounded executor, off the event loop"""
+
+    def __init__(self, kind: str = "thread", workers: int = 2, timeout: float = 60.0):
+        if kind not in ("thread", "process"):
+            raise ValueError(f"Unknown report executor: {kind}")
+        self.kind = kind
+        self.workers = workers
+        self.timeout = timeout
+        self._executor: Executor = None
+        self._slots = asyncio.Semaphore(workers)
+        self._in_flight: Set[int] = set()
+        self._prewarm_task: asyncio.Task = None
+
+    def _get_executor(self) -> Executor:
+        if self._executor is None:
+            if self.kind == "process":
+                self._executor = ProcessPoolExecutor(max_workers=self.workers)
+            else:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="report")
+        return self._executor
+
+    async def render(
+        self,
+        user_id: int,
+        expenses: List[Expense],
+        category_summary: List[CategoryTotal],
+        daily_summary: List[DailyTotal],
+        start_date: str,
+        end_date: str
+    ) -> tuple[bytes, str]:
+        """Render a report and return (bytes, filename).
+
+        Raises ReportBusyError if the user's previous report is still
+        rendering and asyncio.TimeoutError if this one takes longer than
+        timeout seconds. A render that times out keeps its slot until the
+        worker finishes, so the concurrency cap always holds.
+        """
+        if user_id in self._in_flight:
+            raise ReportBusyError()
+        self._in_flight.add(user_id)
+        submitted = False
+        try:
+            async with asyncio.timeout(self.timeout):
+                await self._slots.acquire()
+                try:
+                    future = asyncio.get_running_loop().run_in_executor(
+                        self._get_executor(),
+                        _render,
+                        expenses,
+                        category_summary,
+                        daily_summary,
+                        start_date,
+                        end_date
+                    )
+                except BaseException:
+                    self._slots.release()
+                    raise
+                submitted = True
+                future.add_done_callback(lambda _: self._finish(user_id))
+                started = time.perf_counter()
+                excel_data, filename = await asyncio.shield(future)
+                metrics.REPORT_RENDER_SECONDS.observe(self.kind, time.perf_counter() - started)
+                metrics.REPORT_BYTES.observe(self.kind, len(excel_data))
+                return excel_data, filename
+        finally:
+            if not submitted:
+                self._in_flight.discard(user_id)
+
+    def _finish(self, user_id: int):
+        self._slots.release()
+        self._in_flight.discard(user_id)
+
+    async def start_prewarm(self):
+        """Schedule prewarm() in the background and return immediately"""
+        if self._prewarm_task is None:
+            self._prewarm_task = asyncio.create_task(self.prewarm())
+
+    async def prewarm(self):
+        """Import the reporting stack in the pool's workers ahead of the first report"""
+        loop = asyncio.get_running_loop()
+        executor = self._get_executor()
+        # A thread pool shares one interpreter, so a single import is enough
+        count = self.workers if self.kind == "process" else 1
+        try:
+            await asyncio.gather(*(loop.run_in_executor(executor, _warm_up) for _ in range(count)))
+        except Exception:
+            logging.exception("Report pre-warm failed")
+
+    def close(self):
+        """Stop the executor, dropping renders that have not started"""
+        if self._executor is not None:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+            self._executor = None
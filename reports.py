@@ -1,28 +1,145 @@
 import io
+import os
 from datetime import datetime
-import pandas as pd
-from typing import List, Dict, Any
+from itertools import chain
+from typing import List, Iterable, Optional
+from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
 from openpyxl.styles import Font, PatternFill
 
+from records import CategoryTotal, DailyTotal, Expense
+
+# "streaming" (openpyxl write-only) or "pandas" (DataFrame based, kept for comparison)
+EXCEL_ENGINE = os.getenv("EXCEL_ENGINE", "streaming")
+
+AMOUNT_FORMAT = "#,##0"
+TOTAL_FONT = Font(bold=True)
+TOTAL_FILL = PatternFill(start_color="FFC7CE", end_color="FFC7CE", fill_type="solid")
+# Free-text column; being the last column, longer text simply overflows
+DESCRIPTION_WIDTH = 40
+
 def format_number(number: int) -> str:
     """Format number with thousand separators"""
     return f"{number:,}".replace(",", " ")
 
+def format_total(total_amount: int) -> str:
+    """Format total row label"""
+    return f"Jami: {format_number(total_amount)} so'm"
+
 def add_total_row(sheet, row_num: int, col_letter: str, total_amount: int):
     """Add total row with formatting"""
     cell = sheet[f"{col_letter}{row_num}"]
-    cell.value = f"Jami: {format_number(total_amount)} so'm"
-    cell.font = Font(bold=True)
-    cell.fill = PatternFill(start_color="FFC7CE", end_color="FFC7CE", fill_type="solid")
+    cell.value = format_total(total_amount)
+    cell.font = TOTAL_FONT
+    cell.fill = TOTAL_FILL
 
 def generate_excel_report(
-    expenses: List[Dict[str, Any]],
-    category_summary: List[Dict[str, Any]],
-    daily_summary: List[Dict[str, Any]],
+    expenses: Iterable[Expense],
+    category_summary: List[CategoryTotal],
+    daily_summary: List[DailyTotal],
     start_date: str,
-    end_date: str
+    end_date: str,
+    engine: Optional[str] = None
 ) -> tuple[bytes, str]:
     """Generate Excel report for the given date range and return bytes"""
+    engine = engine or EXCEL_ENGINE
+    if engine == "streaming":
+        return generate_excel_report_streaming(expenses, category_summary, daily_summary, start_date, end_date)
+    if engine == "pandas":
+        return generate_excel_report_pandas(list(expenses), category_summary, daily_summary, start_date, end_date)
+    raise ValueError(f"Unknown Excel engine: {engine}")
+
+def _total_cell(sheet, total_amount: int) -> WriteOnlyCell:
+    cell = WriteOnlyCell(sheet, value=format_total(total_amount))
+    cell.font = TOTAL_FONT
+    cell.fill = TOTAL_FILL
+    return cell
+
+def _amount_cell(sheet, amount: int) -> WriteOnlyCell:
+    cell = WriteOnlyCell(sheet, value=amount)
+    cell.number_format = AMOUNT_FORMAT
+    return cell
+
+def _set_widths(sheet, widths: List[int]):
+    for letter, width in zip("ABCD", widths):
+        sheet.column_dimensions[letter].width = width + 2
+
+def generate_excel_report_streaming(
+    expenses: Iterable[Expense],
+    category_summary: List[CategoryTotal],
+    daily_summary: List[DailyTotal],
+    start_date: str,
+    end_date: str
+) -> tuple[bytes, str]:
+    """Generate Excel report with openpyxl's write-only mode.
+
+    Expense rows are consumed one at a time and never collected. Write-only
+    sheets need column widths before the first row, so widths come from the
+    summaries, which are one row per category/day and already in memory.
+    """
+    output = io.BytesIO()
+    filename = f"expenses_{start_date}_to_{end_date}.xlsx"
+    workbook = Workbook(write_only=True)
+
+    total_amount = sum(item.total_amount for item in category_summary)
+    total_width = len(format_total(total_amount))
+    category_width = max(
+        [len("Kategoriya")] + [len(str(item.category_name)) for item in category_summary if item.category_name]
+    )
+
+    # Expenses sheet
+    expenses = iter(expenses)
+    first = next(expenses, None)
+    if first is not None:
+        sheet = workbook.create_sheet("Xarajatlar")
+        _set_widths(sheet, [len("dd.mm.yyyy HH:MM"), max(len("Miqdor (so'm)"), total_width), category_width, DESCRIPTION_WIDTH])
+        sheet.append(["Sana", "Miqdor (so'm)", "Kategoriya", "Izoh"])
+        for expense in chain((first,), expenses):
+            sheet.append([
+                datetime.fromisoformat(expense.date).strftime("%d.%m.%Y %H:%M"),
+                _amount_cell(sheet, expense.amount),
+                expense.category_name,
+                expense.description
+            ])
+        sheet.append([None, _total_cell(sheet, total_amount)])
+
+    # Category summary sheet
+    if category_summary:
+        sheet = workbook.create_sheet("Kategoriyalar")
+        _set_widths(sheet, [category_width, len("Xarajatlar soni"), max(len("Umumiy miqdor (so'm)"), total_width)])
+        sheet.append(["Kategoriya", "Xarajatlar soni", "Umumiy miqdor (so'm)"])
+        for item in category_summary:
+            sheet.append([item.category_name, item.count, _amount_cell(sheet, item.total_amount)])
+        sheet.append([None, None, _total_cell(sheet, total_amount)])
+
+    # Daily summary sheet
+    if daily_summary:
+        daily_total = sum(item.total_amount for item in daily_summary)
+        sheet = workbook.create_sheet("Kunlik")
+        _set_widths(sheet, [len("dd.mm.yyyy"), max(len("Umumiy miqdor (so'm)"), len(format_total(daily_total))), len("Xarajatlar soni")])
+        sheet.append(["Sana", "Umumiy miqdor (so'm)", "Xarajatlar soni"])
+        for item in daily_summary:
+            sheet.append([
+                datetime.fromisoformat(item.expense_date).strftime("%d.%m.%Y"),
+                _amount_cell(sheet, item.total_amount),
+                item.count
+            ])
+        sheet.append([None, _total_cell(sheet, daily_total)])
+
+    workbook.save(output)
+    return output.getvalue(), filename
+
+def generate_excel_report_pandas(
+    expenses: List[Expense],
+    category_summary: List[CategoryTotal],
+    daily_summary: List[DailyTotal],
+    start_date: str,
+    end_date: str
+) -> tuple[bytes, str]:
+    """Generate Excel report through pandas DataFrames"""
+    # pandas is heavy and only needed by this engine
+    import pandas as pd
+
     # Create buffer to store Excel file in memory
     output = io.BytesIO()
     filename = f"expenses_{start_date}_to_{end_date}.xlsx"
@@ -0,0 +1,87 @@
+"""Split a single-file database into shards for DB_SHARDS > 1.
+
+Usage: python split_database.py --shards 4 [--source data/personal_expenses.db]
+
+Users are assigned to shards with the same stable telegram_id hash the bot
+uses. Each user's categories, expenses and rollup rows are copied with
+their ids unchanged. Unfinished dialogs (FSM states) are not copied.
+Shard files must not exist yet; the source is left untouched.
+"""
+import argparse
+import asyncio
+import os
+import sqlite3
+import sys
+
+from database import Database, shard_for, shard_path
+
+# Table -> condition selecting the shard's rows; users go first, the rest follow their user
+TABLES = {
+    "users": "shard_of(telegram_id) = :shard",
+    "categories": "user_id IN (SELECT id FROM main.users)",
+    "expenses": "user_id IN (SELECT id FROM main.users)",
+    "daily_totals": "user_id IN (SELECT id FROM main.users)",
+    "monthly_totals": "user_id IN (SELECT id FROM main.users)",
+    "budgets": "user_id IN (SELECT id FROM main.users)"
+}
+
+def copy_shard(source: str, target: str, shard: int, shard_count: int) -> dict:
+    """Copy one shard's users and their rows from source into target; returns row counts"""
+    conn = sqlite3.connect(target)
+    conn.create_function("shard_of", 1, lambda telegram_id: shard_for(telegram_id, shard_count), deterministic=True)
+    conn.execute("ATTACH DATABASE ? AS src", (source,))
+    counts = {}
+    with conn:
+        for table, condition in TABLES.items():
+            columns = ", ".join(row[1] for row in conn.execute(f"PRAGMA main.table_info({table})"))
+            counts[table] = conn.execute(
+                f"INSERT INTO main.{table} ({columns}) SELECT {columns} FROM src.{table} WHERE {condition}",
+                {"shard": shard}
+            ).rowcount
+    conn.execute("DETACH DATABASE src")
+    conn.close()
+    return counts
+
+async def split(source: str, shard_count: int) -> list:
+    targets = [shard_path(source, shard, shard_count) for shard in range(shard_count)]
+    existing = [target for target in targets if os.path.exists(target)]
+    if existing:
+        raise FileExistsError(f"Shard files already exist: {', '.join(existing)}")
+
+    # Bring the source schema up to date (rollups included) before copying
+    db = Database(source)
+    await db.create_tables()
+    await db.close()
+
+    results = []
+    for shard, target in enumerate(targets):
+        db = Database(target)
+        await db.create_tables()
+        await db.close()
+        counts = copy_shard(source, target, shard, shard_count)
+        results.append({"shard": shard, "path": target, **counts})
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--source", default="data/personal_expenses.db")
+    parser.add_argument("--shards", type=int, required=True)
+    args = parser.parse_args()
+    if args.shards < 2:
+        sys.exit("--shards must be at least 2")
+
+    results = asyncio.run(split(args.source, args.shards))
+    for result in results:
+        print(result)
+
+    # Every source row must have landed in exactly one shard
+    conn = sqlite3.connect(args.source)
+    for table in TABLES:
+        expected = conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+        copied = sum(result[table] for result in results)
+        if copied != expected:
+            sys.exit(f"{table}: copied {copied} rows, source has {expected}")
+    conn.close()
+
+if __name__ == "__main__":
+    main()
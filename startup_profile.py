@@ -0,0 +1,47 @@
+"""Measure import time and resident memory of the bot's startup modules.
+
+Usage: python startup_profile.py [module ...]
+
+Modules are imported one after another in a fresh interpreter, so each line
+shows what that import adds on top of the ones before it.
+"""
+import os
+import sys
+import time
+import importlib
+
+DEFAULT_MODULES = [
+    "dotenv", "pytz", "aiosqlite", "aiogram",
+    "cache", "database", "keyboards", "rendering",
+    "openpyxl", "reports", "pandas",
+]
+
+def rss_kb() -> int:
+    """Current resident set size in KiB"""
+    try:
+        with open("/proc/self/status") as status:
+            for line in status:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    # Not Linux: fall back to the peak RSS, which is close enough while only growing
+    import resource
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak // 1024 if sys.platform == "darwin" else peak
+
+def main(modules):
+    print(f"{'module':<12} {'import ms':>10} {'+RSS MiB':>9} {'RSS MiB':>8}")
+    start_rss = rss_kb()
+    for name in modules:
+        before_rss = rss_kb()
+        started = time.perf_counter()
+        importlib.import_module(name)
+        elapsed = (time.perf_counter() - started) * 1000
+        after_rss = rss_kb()
+        print(f"{name:<12} {elapsed:>10.1f} {(after_rss - before_rss) / 1024:>9.1f} {after_rss / 1024:>8.1f}")
+    print(f"{'total':<12} {'':>10} {(rss_kb() - start_rss) / 1024:>9.1f}")
+
+if __name__ == "__main__":
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    main(sys.argv[1:] or DEFAULT_MODULES)
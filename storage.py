@@ -0,0 +1,155 @@
+import asyncio
+import json
+import logging
+import time
+from collections import defaultdict
+from typing import Any, Dict, Mapping, Optional, Union
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, StateType, StorageKey
+
+from cache import LRUCache
+from database import Database, ShardedDatabase
+
+
+def _key(key: StorageKey) -> str:
+    return ":".join(
+        str(part) for part in (
+            key.bot_id, key.chat_id, key.user_id, key.thread_id,
+            getattr(key, "business_connection_id", None), key.destiny
+        )
+    )
+
+
+def _user_id(name: str) -> int:
+    return int(name.split(":")[2])
+
+
+class SQLiteStorage(BaseStorage):
+    """FSM storage kept in the bot's SQLite database.
+
+    Recently used records live in an in-memory LRU; changes are collected
+    and written in one transaction every flush_interval seconds. Records
+    untouched for ttl seconds are treated as abandoned and purged, so
+    half-finished dialogs do not pile up.
+    """
+
+    def __init__(
+        self,
+        db: Union[Database, ShardedDatabase],
+        ttl: float = 24 * 60 * 60,
+        cache_size: int = 10000,
+        flush_interval: float = 1.0
+    ):
+        self.db = db
+        self.ttl = ttl
+        self.flush_interval = flush_interval
+        # key -> [state, data, updated_at]
+        self._records = LRUCache(cache_size)
+        # Changed records not yet written; kept apart so LRU eviction cannot lose them
+        self._dirty: Dict[str, list] = {}
+        self._flush_lock = asyncio.Lock()
+        self._closing = asyncio.Event()
+        self._last_purge = time.time()
+        self._task: Optional[asyncio.Task] = None
+
+    async def _load(self, key: StorageKey) -> list:
+        name = _key(key)
+        record = self._dirty.get(name) or self._records.get(name)
+        if record is None:
+            async with self.db.pool_for(key.user_id).reader() as conn:
+                async with conn.execute(
+                    "SELECT state, data, updated_at FROM fsm_states WHERE key = ?", (name,)
+                ) as cursor:
+                    row = await cursor.fetchone()
+            record = [row[0], json.loads(row[1]), row[2]] if row else [None, {}, time.time()]
+            self._records.set(name, record)
+
+        if time.time() - record[2] > self.ttl:
+            record[0], record[1] = None, {}
+        return record
+
+    async def _save(self, key: StorageKey, record: list):
+        name = _key(key)
+        record[2] = time.time()
+        self._records.set(name, record)
+        self._dirty[name] = record
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        record = await self._load(key)
+        record[0] = state.state if isinstance(state, State) else state
+        await self._save(key, record)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        return (await self._load(key))[0]
+
+    async def set_data(self, key: StorageKey, data: Mapping[str, Any]) -> None:
+        record = await self._load(key)
+        record[1] = dict(data)
+        await self._save(key, record)
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        return dict((await self._load(key))[1])
+
+    async def _run(self):
+        while self._dirty and not self._closing.is_set():
+            try:
+                await asyncio.wait_for(self._closing.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            try:
+                await self.flush()
+                if time.time() - self._last_purge > min(self.ttl, 600):
+                    await self.purge_expired()
+            except Exception:
+                logging.exception("Failed to persist FSM states")
+
+    async def flush(self):
+        """Write all changed records in a single transaction"""
+        async with self._flush_lock:
+            if not self._dirty:
+                return
+            dirty, self._dirty = self._dirty, {}
+            # pool -> (upserts, deletes); one transaction per shard
+            writes = defaultdict(lambda: ([], []))
+            for name, (state, data, updated_at) in dirty.items():
+                upserts, deletes = writes[self.db.pool_for(_user_id(name))]
+                if state is None and not data:
+                    deletes.append((name,))
+                else:
+                    upserts.append((name, state, json.dumps(data), updated_at))
+            try:
+                for pool, (upserts, deletes) in writes.items():
+                    async with pool.writer() as conn:
+                        await conn.executemany(
+                            "INSERT INTO fsm_states (key, state, data, updated_at) VALUES (?, ?, ?, ?) "
+                            "ON CONFLICT (key) DO UPDATE SET "
+                            "state = excluded.state, data = excluded.data, updated_at = excluded.updated_at",
+                            upserts
+                        )
+                        await conn.executemany("DELETE FROM fsm_states WHERE key = ?", deletes)
+                        await conn.commit()
+            except BaseException:
+                # Put the records back unless they changed again meanwhile; rewriting is harmless
+                for name, record in dirty.items():
+                    self._dirty.setdefault(name, record)
+                raise
+
+    async def purge_expired(self):
+        """Delete persisted records untouched for longer than ttl"""
+        for pool in self.db.pools:
+            async with pool.writer() as conn:
+                await conn.execute("DELETE FROM fsm_states WHERE updated_at < ?", (time.time() - self.ttl,))
+                await conn.commit()
+        self._last_purge = time.time()
+
+    async def close(self) -> None:
+        """Stop the background flusher and write everything still pending"""
+        self._closing.set()
+        if self._task is not None:
+            await self._task
+            self._task = None
+        await self.flush()
+        self._closing.clear()
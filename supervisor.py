@@ -0,0 +1,314 @@
+"""Run several bot worker processes and route updates to them by user.
+
+Usage: python supervisor.py
+
+Each worker is main.py in webhook mode on 127.0.0.1:(WORKER_BASE_PORT +
+index) owning the database shards with shard % BOT_WORKERS == index. The
+supervisor receives updates itself (long polling, or its own webhook when
+BOT_MODE=webhook) and forwards the raw Update JSON to the worker owning
+the sender's shard, so a user's data is only ever touched by one process.
+Workers that exit are restarted. Each worker's highest accepted update_id
+is remembered, so a retried batch never reaches a worker twice; while
+polling, the updates of a worker that stays unavailable are held back and
+redelivered in the background instead of stalling every other worker.
+"""
+import asyncio
+import hmac
+import logging
+import os
+import secrets
+import signal
+import sys
+from collections import defaultdict
+from typing import Dict, List, Optional
+
+import aiohttp
+from aiohttp import web
+from dotenv import load_dotenv
+
+from database import shard_for
+
+API_URL = "https://api.telegram.org/bot{token}/{method}"
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+# Admin commands every worker has to run for its own shards
+BROADCAST_COMMANDS = ("/reset_db",)
+POLL_TIMEOUT = 25
+# How long a forward keeps retrying while a worker is (re)starting
+FORWARD_RETRY_SECONDS = 30.0
+RESTART_DELAY = 1.0
+
+
+def update_user_id(update: dict) -> Optional[int]:
+    """Telegram id of the user (or chat) the update belongs to"""
+    for value in update.values():
+        if not isinstance(value, dict):
+            continue
+        sender = value.get("from") or value.get("user")
+        if isinstance(sender, dict) and "id" in sender:
+            return sender["id"]
+        chat = value.get("chat") or (value.get("message") or {}).get("chat")
+        if isinstance(chat, dict) and "id" in chat:
+            return chat["id"]
+    return None
+
+
+def is_broadcast(update: dict) -> bool:
+    text = (update.get("message") or {}).get("text") or ""
+    command = text.split(maxsplit=1)[0].split("@")[0] if text.startswith("/") else ""
+    return command in BROADCAST_COMMANDS
+
+
+class Supervisor:
+    def __init__(
+        self,
+        token: str,
+        workers: int,
+        shard_count: int,
+        base_port: int = 8100,
+        drain_timeout: float = 30.0
+    ):
+        self.token = token
+        self.workers = workers
+        self.shard_count = shard_count
+        self.base_port = base_port
+        self.drain_timeout = drain_timeout
+        # Shared secret for supervisor -> worker requests
+        self.worker_secret = secrets.token_urlsafe(32)
+        self._processes: Dict[int, asyncio.subprocess.Process] = {}
+        self._stopping = asyncio.Event()
+        self._session: Optional[aiohttp.ClientSession] = None
+        # worker index -> highest update_id it accepted
+        self._delivered: Dict[int, int] = {}
+        # worker index -> updates held back while it is unavailable (polling only)
+        self._held: Dict[int, List[dict]] = {}
+        self._redelivery: Dict[int, asyncio.Task] = {}
+
+    def workers_for(self, update: dict) -> List[int]:
+        if is_broadcast(update):
+            return list(range(self.workers))
+        user_id = update_user_id(update)
+        if user_id is None:
+            return [0]
+        return [shard_for(user_id, self.shard_count) % self.workers]
+
+    def _worker_env(self, index: int) -> Dict[str, str]:
+        env = dict(os.environ)
+        env.update({
+            "BOT_MODE": "webhook",
+            "WEBHOOK_URL": "",
+            "WEBHOOK_HOST": "127.0.0.1",
+            "WEBHOOK_PORT": str(self.base_port + index),
+            "WEBHOOK_PATH": "/webhook",
+            "WEBHOOK_SECRET": self.worker_secret,
+            "WEBHOOK_DRAIN_TIMEOUT": str(self.drain_timeout),
+            "DB_SHARDS": str(self.shard_count),
+            "BOT_WORKERS": str(self.workers),
+            "BOT_WORKER_INDEX": str(index)
+        })
+        if os.getenv("METRICS_PORT"):
+            env["METRICS_PORT"] = str(int(os.environ["METRICS_PORT"]) + index)
+        return env
+
+    async def _run_worker(self, index: int):
+        script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "main.py")
+        while not self._stopping.is_set():
+            process = await asyncio.create_subprocess_exec(sys.executable, script, env=self._worker_env(index))
+            self._processes[index] = process
+            logging.info("Worker %d started (pid %d, port %d)", index, process.pid, self.base_port + index)
+            code = await process.wait()
+            if not self._stopping.is_set():
+                logging.error("Worker %d exited with code %s; restarting", index, code)
+                await asyncio.sleep(RESTART_DELAY)
+
+    async def _post(self, index: int, update: dict):
+        url = f"http://127.0.0.1:{self.base_port + index}/webhook"
+        deadline = asyncio.get_running_loop().time() + FORWARD_RETRY_SECONDS
+        while True:
+            try:
+                async with self._session.post(url, json=update, headers={SECRET_HEADER: self.worker_secret}) as response:
+                    if response.status == 200:
+                        return
+                    if response.status != 503:
+                        logging.error("Worker %d rejected update %s: HTTP %d", index, update.get("update_id"), response.status)
+                        return
+            except aiohttp.ClientConnectionError:
+                pass
+            if asyncio.get_running_loop().time() > deadline:
+                raise ConnectionError(f"Worker {index} unavailable")
+            await asyncio.sleep(0.5)
+
+    def _by_worker(self, updates: List[dict]) -> Dict[int, List[dict]]:
+        by_worker = defaultdict(list)
+        for update in updates:
+            for index in self.workers_for(update):
+                by_worker[index].append(update)
+        return by_worker
+
+    async def _send(self, index: int, updates: List[dict]) -> List[dict]:
+        """Post updates to one worker in order; returns those it did not accept"""
+        for position, update in enumerate(updates):
+            if update["update_id"] <= self._delivered.get(index, -1):
+                # Already accepted when this batch was last attempted
+                continue
+            try:
+                await self._post(index, update)
+            except ConnectionError:
+                return updates[position:]
+            self._delivered[index] = update["update_id"]
+        return []
+
+    async def _forward(self, by_worker: Dict[int, List[dict]]) -> Dict[int, List[dict]]:
+        results = await asyncio.gather(*(self._send(index, updates) for index, updates in by_worker.items()))
+        return {index: rest for index, rest in zip(by_worker, results) if rest}
+
+    async def forward(self, updates: List[dict]) -> Dict[int, List[dict]]:
+        """Send updates to their workers, each worker in order.
+
+        Returns worker index -> updates left undelivered because the worker
+        stayed unavailable; the other workers have taken theirs.
+        """
+        return await self._forward(self._by_worker(updates))
+
+    async def _redeliver(self, index: int):
+        """Retry a worker's held-back updates until it takes them all"""
+        try:
+            while True:
+                held = self._held[index]
+                await self._send(index, list(held))
+                # Updates appended by poll meanwhile stay queued behind the delivered ones
+                delivered = self._delivered.get(index, -1)
+                held[:] = [update for update in held if update["update_id"] > delivered]
+                if not held:
+                    del self._held[index]
+                    logging.info("Worker %d is back; held updates delivered", index)
+                    return
+        finally:
+            self._redelivery.pop(index, None)
+
+    async def _api(self, method: str, **params):
+        params = {key: value for key, value in params.items() if value is not None}
+        async with self._session.post(API_URL.format(token=self.token, method=method), json=params) as response:
+            payload = await response.json()
+        if not payload.get("ok"):
+            raise RuntimeError(f"{method} failed: {payload.get('description')}")
+        return payload["result"]
+
+    async def poll(self):
+        """Long-poll getUpdates and forward each batch before confirming it.
+
+        Updates of an unavailable worker are held in memory and redelivered
+        in the background; they are lost if the supervisor itself stops.
+        """
+        offset = None
+        while not self._stopping.is_set():
+            try:
+                updates = await self._api("getUpdates", offset=offset, timeout=POLL_TIMEOUT)
+                if updates:
+                    ready = {}
+                    for index, worker_updates in self._by_worker(updates).items():
+                        if index in self._held:
+                            # Keep the worker's order: behind what is already held
+                            self._held[index].extend(worker_updates)
+                        else:
+                            ready[index] = worker_updates
+                    for index, rest in (await self._forward(ready)).items():
+                        logging.error("Worker %d unavailable; holding back %d updates", index, len(rest))
+                        self._held[index] = rest
+                        self._redelivery[index] = asyncio.create_task(self._redeliver(index))
+                    offset = updates[-1]["update_id"] + 1
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logging.exception("Polling failed")
+                await asyncio.sleep(5)
+
+    async def serve_webhook(self, host: str, port: int, url: Optional[str], path: str, secret_token: Optional[str]):
+        """Receive updates on our own webhook; Telegram retries if forwarding fails"""
+        async def handle(request: web.Request) -> web.Response:
+            if secret_token and not hmac.compare_digest(
+                request.headers.get(SECRET_HEADER, "").encode(errors="surrogateescape"), secret_token.encode()
+            ):
+                return web.Response(status=401)
+            try:
+                update = await request.json()
+            except ValueError:
+                return web.Response(status=400)
+            # Telegram redelivers on 503; workers that took it already skip it
+            if await self.forward([update]):
+                return web.Response(status=503)
+            return web.Response()
+
+        app = web.Application()
+        app.router.add_post(path, handle)
+        runner = web.AppRunner(app, handle_signals=False)
+        await runner.setup()
+        await web.TCPSite(runner, host, port).start()
+        if url:
+            await self._api("setWebhook", url=url.rstrip("/") + path, secret_token=secret_token)
+        try:
+            await self._stopping.wait()
+        finally:
+            await runner.cleanup()
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(signum, self._stopping.set)
+
+        self._session = aiohttp.ClientSession()
+        worker_tasks = [asyncio.create_task(self._run_worker(index)) for index in range(self.workers)]
+        if os.getenv("BOT_MODE", "polling") == "webhook":
+            receiver = asyncio.create_task(self.serve_webhook(
+                os.getenv("WEBHOOK_HOST", "0.0.0.0"),
+                int(os.getenv("WEBHOOK_PORT", "8080")),
+                os.getenv("WEBHOOK_URL") or None,
+                os.getenv("WEBHOOK_PATH", "/webhook"),
+                os.getenv("WEBHOOK_SECRET") or None
+            ))
+        else:
+            receiver = asyncio.create_task(self.poll())
+
+        try:
+            await self._stopping.wait()
+        finally:
+            self._stopping.set()
+            receiver.cancel()
+            redelivery = list(self._redelivery.values())
+            for task in redelivery:
+                task.cancel()
+            await asyncio.gather(receiver, *redelivery, return_exceptions=True)
+            for index, held in self._held.items():
+                logging.error("Worker %d never came back; %d held updates dropped", index, len(held))
+            # Workers drain their in-flight updates on SIGTERM
+            for process in self._processes.values():
+                if process.returncode is None:
+                    process.terminate()
+            try:
+                await asyncio.wait_for(asyncio.gather(*worker_tasks), self.drain_timeout + 10)
+            except asyncio.TimeoutError:
+                for process in self._processes.values():
+                    if process.returncode is None:
+                        process.kill()
+                await asyncio.gather(*worker_tasks)
+            await self._session.close()
+
+
+def main():
+    load_dotenv()
+    logging.basicConfig(level=logging.INFO)
+    workers = int(os.getenv("BOT_WORKERS", str(os.cpu_count() or 1)))
+    shard_count = int(os.getenv("DB_SHARDS", str(workers)))
+    if workers > 1 and shard_count < workers:
+        sys.exit("DB_SHARDS must be at least BOT_WORKERS so every worker owns its own shards")
+    supervisor = Supervisor(
+        token=os.getenv("BOT_TOKEN"),
+        workers=workers,
+        shard_count=shard_count,
+        base_port=int(os.getenv("WORKER_BASE_PORT", "8100")),
+        drain_timeout=float(os.getenv("WEBHOOK_DRAIN_TIMEOUT", "30"))
+    )
+    asyncio.run(supervisor.run())
+
+
+if __name__ == "__main__":
+    main()
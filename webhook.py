@@ -0,0 +1,152 @@
+"""Webhook mode: updates are POSTed by Telegram to an embedded aiohttp server.
+
+Each accepted update is answered right away and processed in a background
+task; at most max_concurrent updates are processed at once, and further
+requests wait for a free slot before they are acknowledged. On shutdown
+new requests get 503 while the updates in progress are given
+drain_timeout seconds to finish.
+"""
+import asyncio
+import hmac
+import logging
+import signal
+from typing import Optional, Set
+
+from aiogram import Bot, Dispatcher
+from aiogram.types import Update
+from aiohttp import web
+from pydantic import ValidationError
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+class WebhookServer:
+    """aiohttp application feeding webhook updates into the dispatcher"""
+
+    def __init__(
+        self,
+        dispatcher: Dispatcher,
+        bot: Bot,
+        path: str = "/webhook",
+        secret_token: Optional[str] = None,
+        max_concurrent: int = 100,
+        drain_timeout: float = 30.0
+    ):
+        self.dispatcher = dispatcher
+        self.bot = bot
+        self.path = path
+        self.secret_token = secret_token
+        self.max_concurrent = max_concurrent
+        self.drain_timeout = drain_timeout
+        self._slots = asyncio.Semaphore(max_concurrent)
+        self._tasks: Set[asyncio.Task] = set()
+        self._draining = False
+        self._runner: Optional[web.AppRunner] = None
+
+    def make_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post(self.path, self.handle_update)
+        app.router.add_get("/healthz", self.handle_health)
+        return app
+
+    async def handle_health(self, request: web.Request) -> web.Response:
+        return web.Response(status=503 if self._draining else 200, text="draining" if self._draining else "ok")
+
+    async def handle_update(self, request: web.Request) -> web.Response:
+        # Compared as bytes: compare_digest raises TypeError on non-ASCII str
+        if self.secret_token and not hmac.compare_digest(
+            request.headers.get(SECRET_HEADER, "").encode(errors="surrogateescape"), self.secret_token.encode()
+        ):
+            return web.Response(status=401)
+        if self._draining:
+            return web.Response(status=503)
+
+        try:
+            update = Update.model_validate(await request.json(), context={"bot": self.bot})
+        except (ValueError, ValidationError):
+            return web.Response(status=400)
+
+        # Backpressure: Telegram keeps the request open until a slot frees up
+        await self._slots.acquire()
+        if self._draining:
+            self._slots.release()
+            return web.Response(status=503)
+        task = asyncio.create_task(self._process(update))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return web.Response()
+
+    async def _process(self, update: Update):
+        try:
+            await self.dispatcher.feed_update(self.bot, update)
+        except Exception:
+            logging.exception("Failed to process update %s", update.update_id)
+        finally:
+            self._slots.release()
+
+    async def start(self, host: str, port: int):
+        self._runner = web.AppRunner(self.make_app(), handle_signals=False)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, host, port).start()
+        logging.info("Webhook server listening on %s:%s%s", host, port, self.path)
+
+    async def drain(self):
+        """Refuse new updates and wait for the ones in progress"""
+        self._draining = True
+        if self._tasks:
+            logging.info("Draining %d in-flight updates", len(self._tasks))
+            _, pending = await asyncio.wait(set(self._tasks), timeout=self.drain_timeout)
+            for task in pending:
+                task.cancel()
+            if pending:
+                logging.warning("Cancelled %d updates still running after drain timeout", len(pending))
+                await asyncio.wait(pending)
+
+    async def stop(self):
+        await self.drain()
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+
+async def run_webhook(
+    dispatcher: Dispatcher,
+    bot: Bot,
+    host: str,
+    port: int,
+    url: Optional[str] = None,
+    path: str = "/webhook",
+    secret_token: Optional[str] = None,
+    max_concurrent: int = 100,
+    drain_timeout: float = 30.0
+):
+    """Serve updates until SIGINT/SIGTERM, then drain and shut down.
+
+    When url is given the webhook is registered with Telegram on startup;
+    without it the server only accepts updates POSTed to it directly,
+    which is handy for replaying recorded updates locally.
+    """
+    server = WebhookServer(dispatcher, bot, path, secret_token, max_concurrent, drain_timeout)
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(signum, stop.set)
+        except (NotImplementedError, RuntimeError):
+            pass
+
+    await dispatcher.emit_startup(bot=bot, dispatcher=dispatcher)
+    try:
+        await server.start(host, port)
+        if url:
+            await bot.set_webhook(
+                url.rstrip("/") + path,
+                secret_token=secret_token,
+                max_connections=min(max_concurrent, 100),
+                allowed_updates=dispatcher.resolve_used_update_types()
+            )
+        await stop.wait()
+    finally:
+        await server.stop()
+        await dispatcher.emit_shutdown(bot=bot, dispatcher=dispatcher)
+        await bot.session.close()